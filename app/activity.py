@@ -0,0 +1,42 @@
+# app/activity.py
+"""
+Denormalized activity counters on groups (member_count, transaction_count, total_spent_base,
+last_activity_at). Write paths keep them current with Group.record_activity; recount rebuilds
+them from the source tables for databases created before the counters, or after the base
+currency changed.
+"""
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from backend.schema import Group, GroupMember, Transaction
+
+def recount(db: Session, group_id: Optional[int] = None) -> int:
+    """Recompute the counters of one group (or all of them) in a single UPDATE. Does not commit."""
+    members = (
+        select(func.count(GroupMember.id))
+        .where(GroupMember.group_id == Group.id, GroupMember.left_at.is_(None))
+        .scalar_subquery()
+    )
+    transactions = select(func.count(Transaction.id)).where(Transaction.group_id == Group.id).scalar_subquery()
+    spent = (
+        select(func.coalesce(func.sum(Transaction.total_in_group_currency), 0))
+        .where(Transaction.group_id == Group.id)
+        .scalar_subquery()
+    )
+    last_transaction = select(func.max(Transaction.created_at)).where(Transaction.group_id == Group.id).scalar_subquery()
+
+    stmt = (
+        update(Group)
+        .values(
+            member_count=members,
+            transaction_count=transactions,
+            total_spent_base=spent,
+            last_activity_at=func.coalesce(Group.last_activity_at, last_transaction, Group.created_at),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if group_id is not None:
+        stmt = stmt.where(Group.id == group_id)
+    return db.execute(stmt).rowcount
@@ -3,13 +3,16 @@ Helpers for Google OAuth: build login url, exchange code for tokens, verify id_t
 Uses google-auth for secure id_token verification.
 """
 import os
-import requests
 from typing import Dict, Any
 from google.oauth2 import id_token
+from google.auth import exceptions as google_exceptions
 from google.auth.transport import requests as google_requests
+import requests
 import dotenv
 from pathlib import Path
 
+from app import outbound
+
 dotenv.load_dotenv(dotenv.find_dotenv())
 
 
@@ -20,6 +23,24 @@ GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")  # must match Google Cons
 GOOGLE_AUTH_URL = "https://accounts.google.com/o/oauth2/v2/auth"
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 
+class _OutboundRequest(google_requests.Request):
+    """
+    google-auth transport that sends through the shared outbound client, so the cert fetch of
+    id_token verification gets its deadline, retries and circuit breaker (google-auth would
+    otherwise wait up to 120 s).
+    """
+    def __init__(self):
+        self.session = None  # the shared client owns its session, nothing to close on __del__
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        try:
+            response = outbound.client.request(method, url, data=body, headers=headers, **kwargs)
+        except requests.RequestException as exc:
+            raise google_exceptions.TransportError(exc) from exc
+        return google_requests._Response(response)
+
+_google_request = _OutboundRequest()
+
 def build_google_auth_url(state: str | None = None, scope: str = "openid email profile") -> str:
     """Return URL to redirect the user to Google sign-in."""
     from urllib.parse import urlencode
@@ -44,7 +65,7 @@ def exchange_code_for_tokens(code: str) -> Dict[str, Any]:
         "redirect_uri": GOOGLE_REDIRECT_URI,
         "grant_type": "authorization_code",
     }
-    resp = requests.post(GOOGLE_TOKEN_URL, data=data, timeout=10)
+    resp = outbound.client.post(GOOGLE_TOKEN_URL, data=data, timeout=10)
     resp.raise_for_status()
     return resp.json()
 
@@ -55,7 +76,7 @@ def verify_id_token(id_token_str: str) -> Dict[str, Any]:
     """
     # google-auth will validate signature, exp, audience
     try:
-        claims = id_token.verify_oauth2_token(id_token_str, google_requests.Request(), GOOGLE_CLIENT_ID, clock_skew_in_seconds=60)
+        claims = id_token.verify_oauth2_token(id_token_str, _google_request, GOOGLE_CLIENT_ID, clock_skew_in_seconds=60)
     except ValueError as exc:
         # invalid token
         raise
@@ -0,0 +1,99 @@
+# app/backfill.py
+"""
+Background resolution of deferred exchange rates.
+
+Request handlers never call the FX provider: when no stored or cached rate is available a
+transaction is saved without one and counted as pending. This worker refreshes the rate sheet,
+looks up the dated rate of every pending (currency, day) in bulk and writes it back, so the
+transactions move into the ledger and reads stop converting them on the fly.
+
+The same pass re-rates groups whose base currency changed: their rated transactions are deferred
+against the old base (see ledger.mark_rerate) and resolved here with the dated old -> new rate.
+"""
+from typing import Callable, Optional
+import logging
+import os
+import threading
+
+from sqlalchemy.orm import Session
+
+from app import fx, ledger
+from backend.schema import Group
+
+logger = logging.getLogger(__name__)
+
+# seconds between runs of the worker, 0 disables it
+BACKFILL_INTERVAL_SECONDS = int(os.getenv("FX_BACKFILL_INTERVAL", "600"))
+
+def backfill_rates(db: Session, fetch: bool = True) -> int:
+    """
+    Resolve every deferred exchange rate a rate can be found for, one commit per group.
+    Returns the number of transactions resolved. With fetch=False only stored and cached sheets are used.
+    """
+    if fetch and fx.rate_table.refresh():
+        fx.store_sheets(db, list(fx.rate_table.sheets.values()))
+        db.commit()
+
+    resolved = 0
+    for group_id in ledger.groups_with_pending(db):
+        group = db.get(Group, group_id)
+        pending_rates = {}
+        for currency, day in ledger.pending_rate_keys(db, group): # type: ignore
+            rate = fx.rate_on(db, currency, group.base_currency, day, fetch) # type: ignore
+            if rate is not None:
+                pending_rates[(currency, day)] = rate
+        resolved += ledger.resolve_pending(db, group, pending_rates) # type: ignore
+        db.commit()
+    return resolved
+
+class BackfillWorker(threading.Thread):
+    """Daemon thread running backfill_rates every interval seconds, or sooner when kicked."""
+    def __init__(self, session_factory: Callable[[], Session], interval: int = BACKFILL_INTERVAL_SECONDS):
+        super().__init__(name="fx-backfill", daemon=True)
+        self.session_factory = session_factory
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def kick(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            db = self.session_factory()
+            try:
+                resolved = backfill_rates(db)
+                if resolved:
+                    logger.info("Resolved %d deferred exchange rate(s)", resolved)
+            except Exception:
+                db.rollback()
+                logger.exception("Exchange rate backfill failed")
+            finally:
+                db.close()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+worker: Optional[BackfillWorker] = None
+
+def start_worker(session_factory: Callable[[], Session], interval: int = BACKFILL_INTERVAL_SECONDS) -> Optional[BackfillWorker]:
+    """Start the process-wide worker once. Does nothing if interval is 0."""
+    global worker
+    if worker is None and interval > 0:
+        worker = BackfillWorker(session_factory, interval)
+        worker.start()
+    return worker
+
+def stop_worker() -> None:
+    global worker
+    if worker is not None:
+        worker.stop()
+        worker = None
+
+def request_run() -> None:
+    """Ask the worker to run soon (eg. a request just met a missing rate). No-op when it is not running."""
+    if worker is not None:
+        worker.kick()
@@ -0,0 +1,388 @@
+# app/fx.py
+"""
+Process-wide exchange rate table.
+
+Provider responses (one file per base currency, ~160 rates each) are read from disk or fetched
+once and kept in a single float array: one row per loaded base currency, one column per quote
+currency. Any pair is derived from any fresh row that quotes both currencies as
+rates[to] / rates[from], so one sheet (the reference currency's) covers every pair and the
+provider is asked about once per TTL window. Each row expires at the provider's
+time_next_update_unix. A refresher thread fetches each sheet shortly before that; if a request
+still meets an expired sheet it is served the slightly stale rate while the refresher is woken
+to revalidate it in the background.
+
+Every sheet seen is also kept in the fx_rates table under the day it was published, so
+transactions are converted at the rate of the day they were created and the same lookup
+always gives the same answer.
+"""
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import requests
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+from app import currencies, outbound
+from backend.schema import FxRate
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_CACHE_DIR = Path(os.getenv("EXCHANGE_CACHE_DIR", Path(__file__).resolve().parent.parent / "exchange_cache"))
+EXCHANGE_API_URL = "https://open.er-api.com/v6/latest/{currency}"
+EXCHANGE_API_TIMEOUT = 10
+# sheet fetched when no fresh sheet quotes a pair, it lists every supported currency
+REFERENCE_CURRENCY = os.getenv("FX_REFERENCE_CURRENCY", "USD")
+# how long to wait before asking the provider again about a currency it could not price
+MISS_RETRY_SECONDS = 300
+# a stored sheet older than this is not used for a later day
+SHEET_MAX_AGE_DAYS = 7
+# sheets are refetched this long before they expire
+REFRESH_LEAD_SECONDS = int(os.getenv("FX_REFRESH_LEAD", "300"))
+# how long past expiry a sheet may still be served to requests while it is refreshed
+STALE_GRACE_SECONDS = int(os.getenv("FX_STALE_GRACE", str(24 * 3600)))
+# bounds of the refresher's sleep between checks
+REFRESH_MIN_WAIT_SECONDS = 30
+REFRESH_MAX_WAIT_SECONDS = 3600
+
+class _Rates(NamedTuple):
+    bases: Dict[str, int]    # base currency -> row
+    quotes: Dict[str, int]   # quote currency -> column
+    table: np.ndarray        # table[row, column] = units of quote per unit of base, NaN if unknown
+    expires: np.ndarray      # time_next_update_unix per row
+
+def _now() -> int:
+    return int(datetime.now(timezone.utc).timestamp())
+
+class RateTable:
+    """
+    Exchange rates of every base currency loaded so far. Readers never lock: the table is
+    rebuilt on load and swapped in with one assignment.
+    """
+    def __init__(self, cache_dir: Path = EXCHANGE_CACHE_DIR, reference_currency: str = REFERENCE_CURRENCY):
+        self.cache_dir = Path(cache_dir)
+        self.reference_currency = reference_currency
+        self._rates = _Rates({}, {}, np.empty((0, 0), dtype=np.float64), np.empty(0, dtype=np.int64))
+        self._lock = threading.Lock()
+        self._retry_after: Dict[str, int] = {}
+        # latest raw sheet per base currency, kept to be written to fx_rates
+        self.sheets: Dict[str, dict] = {}
+        # mtime of every sheet file already read, so unchanged files are not parsed again
+        self._file_mtimes: Dict[str, float] = {}
+
+    def _row(self, rates: _Rates, currency: str, now: int) -> Optional[int]:
+        row = rates.bases.get(currency)
+        if row is None or rates.expires[row] <= now:
+            return None
+        return row
+
+    def lookup(self, from_currency: str, to_currency: str, now: Optional[int] = None, stale_grace: int = 0) -> Optional[float]:
+        """
+        Rate converting from_currency to to_currency from unexpired rows only (or rows expired less
+        than stale_grace seconds ago), None on a miss. The rows of the two currencies themselves are
+        preferred, then any other row quoting both.
+        """
+        rates = self._rates
+        now = _now() if now is None else now
+
+        from_column = rates.quotes.get(from_currency)
+        to_column = rates.quotes.get(to_currency)
+        if from_column is None or to_column is None:
+            return None
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cross = rates.table[:, to_column] / rates.table[:, from_column]
+        usable = (rates.expires + stale_grace > now) & np.isfinite(cross) & (cross > 0)
+        if not usable.any():
+            return None
+
+        for currency in (from_currency, to_currency):
+            row = rates.bases.get(currency)
+            if row is not None and usable[row]:
+                return float(cross[row])
+        return float(cross[np.argmax(usable)])
+
+    def load(self, data: dict) -> None:
+        """Add or replace the row of one provider response."""
+        with self._lock:
+            rates = self._rates
+            quotes = dict(rates.quotes)
+            for currency in data["rates"]:
+                quotes.setdefault(currency, len(quotes))
+
+            bases = dict(rates.bases)
+            row = bases.setdefault(data["base_code"], len(bases))
+
+            table = np.full((len(bases), len(quotes)), np.nan, dtype=np.float64)
+            table[:rates.table.shape[0], :rates.table.shape[1]] = rates.table
+            table[row, :] = np.nan
+            for currency, rate in data["rates"].items():
+                table[row, quotes[currency]] = float(rate)
+
+            expires = np.zeros(len(bases), dtype=np.int64)
+            expires[:len(rates.expires)] = rates.expires
+            expires[row] = int(data["time_next_update_unix"])
+
+            self._rates = _Rates(bases, quotes, table, expires)
+            self.sheets[data["base_code"]] = data
+
+    def _load_files(self, now: int) -> bool:
+        """
+        Load every sheet on disk that changed since it was last read and is newer than the row in
+        memory. Expired sheets are loaded too, they can still be served stale. True if any sheet
+        that is fresh now was loaded.
+        """
+        if not self.cache_dir.exists():
+            return False
+        loaded = False
+        for path in sorted(self.cache_dir.glob("*.json")):
+            mtime = path.stat().st_mtime
+            if self._file_mtimes.get(path.stem) == mtime:
+                continue
+            self._file_mtimes[path.stem] = mtime
+            with open(path, "r") as f:
+                data = json.load(f)
+            expires = int(data["time_next_update_unix"])
+            row = self._rates.bases.get(data["base_code"])
+            if row is not None and self._rates.expires[row] >= expires:
+                continue
+            self.load(data)
+            loaded = loaded or expires > now
+        return loaded
+
+    def _fetch(self, currency: str) -> bool:
+        """Ask the provider for a fresh table and save it next to the others."""
+        try:
+            resp = outbound.client.get(EXCHANGE_API_URL.format(currency=currency), timeout=EXCHANGE_API_TIMEOUT)
+        except requests.RequestException:
+            return False
+        if resp.status_code != 200:
+            return False
+        data = resp.json()
+        if data.get("result") != "success":
+            return False
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_dir / f"{currency}.json"
+        with open(path, "w") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        self._file_mtimes[currency] = path.stat().st_mtime
+        self.load(data)
+        return True
+
+    def get_rate(self, from_currency: str, to_currency: str, fetch: bool = True) -> Optional[float]:
+        """
+        Rate converting from_currency to to_currency: memory first, then the sheets on disk, then the
+        provider. None if no source has it (the caller defers the conversion).
+
+        With fetch=False (request handlers) the provider is never asked; an expired sheet is served
+        for up to STALE_GRACE_SECONDS instead and the refresher is woken to revalidate it.
+        """
+        now = _now()
+        rate = self.lookup(from_currency, to_currency, now)
+        if rate is None and self._load_files(now):
+            rate = self.lookup(from_currency, to_currency, now)
+        if rate is not None:
+            return rate
+        if not fetch:
+            rate = self.lookup(from_currency, to_currency, now, stale_grace=STALE_GRACE_SECONDS)
+            if rate is not None:
+                request_refresh()
+            return rate
+
+        # one reference sheet prices every pair, only ask for it again once it expired
+        if self._row(self._rates, self.reference_currency, now) is None and self._try_fetch(self.reference_currency, now):
+            rate = self.lookup(from_currency, to_currency, now)
+            if rate is not None:
+                return rate
+
+        # a currency the reference sheet does not quote, try its own sheet now and then; codes
+        # outside ISO 4217 would only cost the provider a round trip to say no
+        for currency in (from_currency, to_currency):
+            if currency not in self._rates.quotes and currencies.is_known(currency) and self._try_fetch(currency, now):
+                rate = self.lookup(from_currency, to_currency, now)
+                if rate is not None:
+                    return rate
+        return None
+
+    def refresh(self) -> bool:
+        """Make sure the reference sheet is fresh, fetching it if it expired. True if it is fresh."""
+        now = _now()
+        if self._row(self._rates, self.reference_currency, now) is None:
+            self._load_files(now)
+        if self._row(self._rates, self.reference_currency, now) is None:
+            return self._try_fetch(self.reference_currency, now)
+        return True
+
+    def refresh_due(self, lead: int = REFRESH_LEAD_SECONDS) -> int:
+        """
+        Refetch every loaded sheet that expires within lead seconds (the reference sheet is always
+        kept loaded). Returns how many seconds until the next sheet is due.
+        """
+        now = _now()
+        self.refresh()
+        rates = self._rates
+        for base, row in rates.bases.items():
+            if rates.expires[row] - lead <= now:
+                self._try_fetch(base, now)
+
+        rates = self._rates
+        if not len(rates.expires):
+            return REFRESH_MAX_WAIT_SECONDS
+        # sheets that could not be fetched come back after their retry window
+        next_due = int(rates.expires.min()) - lead - _now()
+        return min(max(next_due, REFRESH_MIN_WAIT_SECONDS), REFRESH_MAX_WAIT_SECONDS)
+
+    def _try_fetch(self, currency: str, now: int) -> bool:
+        """_fetch, unless the provider failed for this currency in the last MISS_RETRY_SECONDS."""
+        if self._retry_after.get(currency, 0) > now:
+            return False
+        if self._fetch(currency):
+            self._retry_after.pop(currency, None)
+            return True
+        self._retry_after[currency] = now + MISS_RETRY_SECONDS
+        return False
+
+rate_table = RateTable()
+
+class RateRefresher(threading.Thread):
+    """Daemon thread keeping the sheets of a RateTable fresh ahead of their expiry."""
+    def __init__(self, table: RateTable, lead: int = REFRESH_LEAD_SECONDS):
+        super().__init__(name="fx-refresh", daemon=True)
+        self.table = table
+        self.lead = lead
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def kick(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                wait = self.table.refresh_due(self.lead)
+            except Exception:
+                logger.exception("Exchange rate refresh failed")
+                wait = REFRESH_MIN_WAIT_SECONDS
+            self._wake.wait(wait)
+            self._wake.clear()
+
+refresher: Optional[RateRefresher] = None
+
+def start_refresher() -> RateRefresher:
+    """Start the process-wide refresher of rate_table once."""
+    global refresher
+    if refresher is None:
+        refresher = RateRefresher(rate_table)
+        refresher.start()
+    return refresher
+
+def stop_refresher() -> None:
+    global refresher
+    if refresher is not None:
+        refresher.stop()
+        refresher = None
+
+def request_refresh() -> None:
+    """Wake the refresher (eg. a request was just served a stale rate). No-op when it is not running."""
+    if refresher is not None:
+        refresher.kick()
+
+def sheet_date(data: dict) -> date:
+    """The day a provider sheet was published (UTC)."""
+    return datetime.fromtimestamp(int(data["time_last_update_unix"]), timezone.utc).date()
+
+def store_sheets(db: Session, sheets: List[dict]) -> None:
+    """Add the quotes of every sheet that is not in fx_rates yet. Does not commit."""
+    keys = {(sheet_date(sheet), sheet["base_code"]): sheet for sheet in sheets}
+    if not keys:
+        return
+    stored = set(db.execute(
+        select(FxRate.rate_date, FxRate.base).where(tuple_(FxRate.rate_date, FxRate.base).in_(list(keys))).distinct()
+    ).all())
+    for (rate_date, base), sheet in keys.items():
+        if (rate_date, base) in stored:
+            continue
+        db.add_all(
+            FxRate(rate_date=rate_date, base=base, quote=quote, rate=float(rate))
+            for quote, rate in sheet["rates"].items()
+        )
+    db.flush()
+
+def _stored_rate(db: Session, from_currency: str, to_currency: str, on: date) -> Optional[float]:
+    """
+    Rate from the latest stored sheet published on or up to SHEET_MAX_AGE_DAYS before `on` that
+    quotes both currencies, else from the earliest one after it. None if no stored sheet fits.
+    """
+    both = (
+        select(FxRate.rate_date, FxRate.base)
+        .where(FxRate.quote.in_([from_currency, to_currency]))
+        .group_by(FxRate.rate_date, FxRate.base)
+        .having(func.count(FxRate.quote.distinct()) == 2)
+    )
+    sheet = db.execute(
+        both.where(FxRate.rate_date <= on, FxRate.rate_date >= on - timedelta(days=SHEET_MAX_AGE_DAYS))
+        .order_by(FxRate.rate_date.desc())
+        .limit(1)
+    ).first()
+    if sheet is None:
+        sheet = db.execute(both.where(FxRate.rate_date > on).order_by(FxRate.rate_date).limit(1)).first()
+    if sheet is None:
+        return None
+
+    rates = dict(db.execute(
+        select(FxRate.quote, FxRate.rate).where(
+            FxRate.rate_date == sheet.rate_date,
+            FxRate.base == sheet.base,
+            FxRate.quote.in_([from_currency, to_currency]),
+        )
+    ).all())
+    if not rates[from_currency]:
+        return None
+    return rates[to_currency] / rates[from_currency]
+
+def rate_on(db: Session, from_currency: str, to_currency: str, on: date, fetch: bool = True, store: bool = True) -> Optional[float]:
+    """
+    Rate converting from_currency to to_currency on a given day, from the fx_rates table. Falls back
+    to the live table when nothing is stored yet, and stores the sheets it used. With fetch=False the
+    provider is never asked, so the call does no network I/O. Read-only callers that never commit
+    pass store=False and get the live rate without writing anything.
+    """
+    rate = _stored_rate(db, from_currency, to_currency, on)
+    if rate is not None:
+        return rate
+
+    rate = rate_table.get_rate(from_currency, to_currency, fetch)
+    if rate is None or not store:
+        return rate
+    store_sheets(db, list(rate_table.sheets.values()))
+    return _stored_rate(db, from_currency, to_currency, on)
+
+def get_exchange_rate(
+    transaction_currency: str,
+    group_currency: str,
+    db: Optional[Session] = None,
+    on: Optional[date] = None,
+    fetch: bool = True,
+    store: bool = True,
+) -> Optional[float]:
+    """
+    Rate converting transaction_currency to group_currency, None if they match or no rate is available.
+    With a session the rate is the dated one for `on` (default today); without one it is the current rate.
+    Request handlers pass fetch=False and leave provider calls to the backfill worker; handlers
+    that do not commit also pass store=False.
+    """
+    if transaction_currency == group_currency:
+        return None
+    if db is None:
+        return rate_table.get_rate(transaction_currency, group_currency, fetch)
+    return rate_on(db, transaction_currency, group_currency, on or datetime.now(timezone.utc).date(), fetch, store)
@@ -0,0 +1,714 @@
+# app/ledger.py
+"""
+Helpers for the pairwise balance ledger (group_balances table).
+
+The ledger is updated in the same DB transaction as every transaction write so that
+dues can be read in O(members) rows instead of replaying the whole group history.
+Amounts are converted to the group's base currency once, when the transaction is written
+(total_in_group_currency / amount_in_group_currency). Transactions whose exchange rate was
+deferred have no converted amounts yet, so they are left out of the ledger and handled
+by the caller.
+
+Closing a period folds every converted transaction up to a cutoff into a LedgerCheckpoint.
+Reads that aggregate transactions (rebuild, balance matrix, history) start from the latest
+checkpoint and only replay live transactions, so their cost follows recent activity.
+"""
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterator, List, Optional, Tuple
+import heapq
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Date, Numeric, and_, case, delete, func, insert, not_, or_, select, type_coerce, update
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, lazyload
+
+from backend.schema import Group, GroupBalance, GroupMember, LedgerCheckpoint, Split, Transaction, User
+
+TWO_PLACES = Decimal(10) ** -2
+# scale of the Numeric amount columns
+SIX_PLACES = Decimal(10) ** -6
+
+# (user_a, user_b) with user_a < user_b -> amount user_b owes user_a
+PairDeltas = Dict[Tuple[int, int], Decimal]
+# (from_user_id, to_user_id, amount)
+Transfer = Tuple[int, int, Decimal]
+# a transaction together with its splits
+TransactionWithSplits = Tuple[Transaction, List[Split]]
+# (currency, day the transaction was created) -> rate to the base currency, for deferred transactions
+PendingRates = Dict[Tuple[str, date], float]
+
+STREAM_CHUNK_SIZE = 500
+AMOUNT_TYPE = Numeric(precision=18, scale=6)
+
+def _multiplier(transaction: Transaction, base_currency: str) -> Optional[Decimal]:
+    if transaction.currency == base_currency:
+        return Decimal(1)
+    # a rate against an old base currency is waiting for the re-rating job
+    if transaction.exchange_rate_to_group is None or transaction.rerate_from is not None:
+        return None
+    return Decimal(str(transaction.exchange_rate_to_group))
+
+def convert_transaction(transaction: Transaction, base_currency: str, splits: Optional[List[Split]] = None) -> None:
+    """
+    Fill the stored base-currency amounts of a transaction and its splits from its rate, or
+    clear them if the rate is still deferred. Pass splits when transaction.splits is not loaded.
+    """
+    multiplier = _multiplier(transaction, base_currency)
+    if splits is None:
+        splits = transaction.splits
+
+    def convert(amount: Decimal) -> Optional[Decimal]:
+        if multiplier is None:
+            return None
+        return (Decimal(amount) * multiplier).quantize(SIX_PLACES, rounding=ROUND_HALF_UP)
+
+    transaction.total_in_group_currency = convert(transaction.total_amount_cents)
+    for split in splits:
+        split.amount_in_group_currency = convert(split.amount_cents)
+
+def add_to_pair(deltas: PairDeltas, creditor_id: int, debtor_id: int, amount: Decimal) -> None:
+    """Record that debtor owes creditor `amount` more than before."""
+    if creditor_id == debtor_id or not amount:
+        return
+    if creditor_id < debtor_id:
+        key, signed = (creditor_id, debtor_id), amount
+    else:
+        key, signed = (debtor_id, creditor_id), -amount
+    deltas[key] = deltas.get(key, Decimal(0)) + signed
+
+def convert_group(db: Session, group: Group) -> None:
+    """
+    Recompute the stored base-currency amounts of every transaction in a group in two UPDATE
+    statements (eg. after the base currency changed, or to backfill rows written before the
+    columns existed). Rows whose rate is still deferred end up NULL. Does not commit, and
+    loaded Transaction/Split objects are not refreshed until the session expires them.
+    """
+    base_currency = group.base_currency
+    db.execute(
+        update(Transaction)
+        .where(Transaction.group_id == group.id)
+        .values(total_in_group_currency=case(
+            (Transaction.currency == base_currency, Transaction.total_amount_cents),
+            (Transaction.rerate_from.is_not(None), None),
+            else_=func.round(Transaction.total_amount_cents * Transaction.exchange_rate_to_group, 6),
+        ))
+        .execution_options(synchronize_session=False)
+    )
+    converted = (
+        select(case(
+            (Transaction.currency == base_currency, Split.amount_cents),
+            (Transaction.rerate_from.is_not(None), None),
+            else_=func.round(Split.amount_cents * Transaction.exchange_rate_to_group, 6),
+        ))
+        .where(Transaction.id == Split.transaction_id)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Split)
+        .where(Split.transaction_id.in_(select(Transaction.id).where(Transaction.group_id == group.id)))
+        .values(amount_in_group_currency=converted)
+        .execution_options(synchronize_session=False)
+    )
+
+def transaction_deltas(transaction: Transaction, base_currency: str, sign: int = 1, deltas: Optional[PairDeltas] = None) -> PairDeltas:
+    """
+    Pair deltas contributed by a transaction, from its stored base-currency amounts (with the
+    same fallback as _converted_amount). Pass sign=-1 to get the deltas that undo it. Pending
+    transactions contribute nothing.
+    """
+    if deltas is None:
+        deltas = {}
+    for split in transaction.splits:
+        amount = split.amount_in_group_currency
+        # base-currency rows written before amounts were stored need no conversion either
+        if amount is None and transaction.currency == base_currency:
+            amount = split.amount_cents
+        if amount is not None:
+            add_to_pair(deltas, transaction.payer_id, split.user_id, amount * sign)
+    return deltas
+
+def _add_to_balance(db: Session, group_id: int, user_a: int, user_b: int, amount: Decimal) -> bool:
+    """Increment a stored pair balance in SQL. False if the pair has no row yet."""
+    result = db.execute(
+        update(GroupBalance)
+        .where(GroupBalance.group_id == group_id, GroupBalance.user_a == user_a, GroupBalance.user_b == user_b)
+        .values(amount=GroupBalance.amount + amount)
+    )
+    return result.rowcount == 1 # type: ignore
+
+def apply_deltas(db: Session, group_id: int, deltas: PairDeltas) -> None:
+    """
+    Add the deltas onto the stored balances. The increments are done by the database, so
+    concurrent writers to the same pair do not overwrite each other. Does not commit.
+    """
+    # a fixed order keeps two writers from locking the same pairs the other way round
+    for (user_a, user_b), amount in sorted(deltas.items()):
+        if not amount or _add_to_balance(db, group_id, user_a, user_b, amount):
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(GroupBalance).values(group_id=group_id, user_a=user_a, user_b=user_b, amount=amount))
+        except IntegrityError:
+            # another transaction inserted the pair first, add onto its row
+            _add_to_balance(db, group_id, user_a, user_b, amount)
+
+def iter_transaction_chunks(db: Session, group_id: int, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[List[TransactionWithSplits]]:
+    """
+    Stream a group's transactions, oldest first, in chunks of (transaction, splits) pairs.
+
+    Transactions are read with yield_per (a server-side cursor where the driver supports it)
+    and the joined eager loads of Transaction.splits and Transaction.payer are switched off, so
+    there is no transaction x split cartesian result. Splits are fetched with one IN query per
+    chunk. Memory stays bounded by chunk_size no matter how large the group is; use the split
+    lists that come with each chunk instead of transaction.splits, which would lazy load again.
+    """
+    stmt = (
+        select(Transaction)
+        .options(lazyload(Transaction.splits), lazyload(Transaction.payer))
+        .where(Transaction.group_id == group_id)
+        .order_by(Transaction.created_at, Transaction.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for partition in db.scalars(stmt).partitions():
+        splits: Dict[int, List[Split]] = {}
+        split_stmt = (
+            select(Split)
+            .where(Split.transaction_id.in_([transaction.id for transaction in partition]))
+            .order_by(Split.transaction_id, Split.id)
+        )
+        for split in db.scalars(split_stmt):
+            splits.setdefault(split.transaction_id, []).append(split)
+
+        yield [(transaction, splits.get(transaction.id, [])) for transaction in partition]
+
+def _is_pending(group: Group):
+    """SQL condition for transactions of the group that have no base-currency amounts yet."""
+    return and_(
+        Transaction.total_in_group_currency.is_(None),
+        Transaction.currency != group.base_currency,
+    )
+
+def _is_live(group: Group):
+    """
+    SQL condition for transactions replayed on top of the latest checkpoint: those not folded
+    into one, and closed ones that lost their conversion to a base currency change (checkpoints
+    only hold converted amounts, so those count again once re-rated).
+    """
+    return or_(Transaction.checkpoint_id.is_(None), _is_pending(group))
+
+def _converted_amount(group: Group):
+    """SQL expression for the base-currency amount of a split, NULL while its rate is deferred."""
+    # base-currency rows written before amounts were stored need no conversion either
+    return case(
+        (Split.amount_in_group_currency.is_not(None), Split.amount_in_group_currency),
+        (Transaction.currency == group.base_currency, Split.amount_cents),
+        else_=None,
+    )
+
+def _created_day():
+    return type_coerce(func.date(Transaction.created_at), Date)
+
+def _pending_currency():
+    """SQL expression for the currency a deferred amount is in: the old base for re-rated rows."""
+    return func.coalesce(Transaction.rerate_from, Transaction.currency)
+
+def _pending_amount(amount):
+    """SQL expression for a deferred amount in _pending_currency(), eg. Split.amount_cents."""
+    return case(
+        (Transaction.rerate_from.is_not(None), amount * func.coalesce(Transaction.exchange_rate_to_group, 1)),
+        else_=amount,
+    )
+
+def mark_rerate(db: Session, group: Group, old_base_currency: str) -> None:
+    """
+    After the base currency of a group changed from old_base_currency, queue its rated
+    transactions for the re-rating job (new rate = old rate * rate of old base -> new base on
+    the transaction's day) and clear their stored amounts, so they count as deferred until then.
+    Base-currency transactions need no rate and are converted right away. Does not commit;
+    follow with convert_group, rederive_checkpoints and rebuild_group.
+    """
+    rated = or_(Transaction.exchange_rate_to_group.is_not(None), Transaction.currency == old_base_currency)
+    db.execute(
+        update(Transaction)
+        .where(Transaction.group_id == group.id, Transaction.currency != group.base_currency, rated)
+        .values(rerate_from=func.coalesce(Transaction.rerate_from, old_base_currency))
+        .execution_options(synchronize_session=False)
+    )
+    # back to the base a queued rate was relative to: it is valid again as it is
+    db.execute(
+        update(Transaction)
+        .where(
+            Transaction.group_id == group.id,
+            or_(Transaction.rerate_from == group.base_currency, Transaction.currency == group.base_currency),
+        )
+        .values(rerate_from=None)
+        .execution_options(synchronize_session=False)
+    )
+
+def pair_currency_sums(db: Session, group: Group, user_id: Optional[int] = None, pending_only: bool = False) -> List[Row]:
+    """
+    Split amounts of the group's live transactions (see _is_live), pre-summed in SQL per
+    (payer_id, user_id, currency, day).
+
+    Each row has `converted`, the sum of the stored base-currency amounts, and `unconverted`,
+    the raw sum of splits from deferred transactions that still have to be multiplied by the
+    rate of that currency on `day` (for transactions waiting on re-rating, `currency` is the old
+    base and `unconverted` is already in it). `day` is only set on rows of deferred transactions, so
+    converted amounts stay in one row per (payer_id, user_id, currency).
+    Pass user_id to keep only rows where that user paid or owes, pending_only to skip rows
+    that are already in the ledger.
+    """
+    is_pending = _is_pending(group)
+    day = type_coerce(case((is_pending, func.date(Transaction.created_at)), else_=None), Date)
+    currency = _pending_currency()
+    stmt = (
+        select(
+            Transaction.payer_id,
+            Split.user_id,
+            currency.label("currency"),
+            day.label("day"),
+            type_coerce(func.coalesce(func.sum(_converted_amount(group)), 0), AMOUNT_TYPE).label("converted"),
+            type_coerce(
+                func.coalesce(func.sum(case((is_pending, _pending_amount(Split.amount_cents)), else_=None)), 0),
+                AMOUNT_TYPE,
+            ).label("unconverted"),
+        )
+        .join(Split, Split.transaction_id == Transaction.id)
+        .where(
+            Transaction.group_id == group.id,
+            _is_live(group),
+            Transaction.payer_id.is_not(None),
+        )
+        .group_by(Transaction.payer_id, Split.user_id, currency, day)
+    )
+    if user_id is not None:
+        stmt = stmt.where(or_(Transaction.payer_id == user_id, Split.user_id == user_id))
+    if pending_only:
+        stmt = stmt.where(is_pending)
+    return list(db.execute(stmt).all())
+
+def _add_pair_sums(db: Session, group: Group, deltas: PairDeltas, *criteria) -> None:
+    """Add the converted split amounts of the group's transactions matching criteria to deltas."""
+    stmt = (
+        select(
+            Transaction.payer_id,
+            Split.user_id,
+            type_coerce(func.coalesce(func.sum(_converted_amount(group)), 0), AMOUNT_TYPE),
+        )
+        .join(Split, Split.transaction_id == Transaction.id)
+        .where(Transaction.group_id == group.id, Transaction.payer_id.is_not(None), *criteria)
+        .group_by(Transaction.payer_id, Split.user_id)
+    )
+    for payer_id, user_id, amount in db.execute(stmt):
+        add_to_pair(deltas, payer_id, user_id, amount)
+
+def latest_checkpoint(db: Session, group_id: int) -> Optional[LedgerCheckpoint]:
+    stmt = (
+        select(LedgerCheckpoint)
+        .where(LedgerCheckpoint.group_id == group_id)
+        .order_by(LedgerCheckpoint.cutoff.desc(), LedgerCheckpoint.id.desc())
+        .limit(1)
+    )
+    return db.scalars(stmt).first()
+
+def checkpoint_pairs(checkpoint: Optional[LedgerCheckpoint]) -> PairDeltas:
+    """Pair balances stored in a checkpoint, empty if there is none."""
+    if checkpoint is None:
+        return {}
+    return {(user_a, user_b): Decimal(amount) for user_a, user_b, amount in checkpoint.balances}
+
+def _pair_rows(balances: PairDeltas) -> List[List]:
+    return [[user_a, user_b, str(amount)] for (user_a, user_b), amount in sorted(balances.items()) if amount]
+
+def close_period(db: Session, group: Group, cutoff: datetime, created_by: Optional[int] = None) -> Tuple[LedgerCheckpoint, int]:
+    """
+    Fold every live, converted transaction created up to cutoff into a new checkpoint on top
+    of the previous one. Deferred transactions stay live until they have a rate.
+    Returns the checkpoint and the number of transactions it closed. Does not commit.
+    """
+    closing = (
+        Transaction.checkpoint_id.is_(None),
+        Transaction.created_at <= cutoff,
+        not_(_is_pending(group)),
+    )
+    balances = checkpoint_pairs(latest_checkpoint(db, group.id))
+    _add_pair_sums(db, group, balances, *closing)
+
+    checkpoint = LedgerCheckpoint(group_id=group.id, cutoff=cutoff, created_by=created_by, balances=_pair_rows(balances))
+    db.add(checkpoint)
+    db.flush()
+
+    result = db.execute(
+        update(Transaction)
+        .where(Transaction.group_id == group.id, *closing)
+        .values(checkpoint_id=checkpoint.id)
+        .execution_options(synchronize_session=False)
+    )
+    return checkpoint, result.rowcount
+
+def rederive_checkpoints(db: Session, group: Group) -> None:
+    """
+    Recompute every checkpoint of a group from the transactions folded into it, eg. after the
+    stored base-currency amounts changed. Transactions stay in their closed period; those that
+    lost their conversion are left out of the totals (and replayed as live, see _is_live) until
+    their rate is resolved. Does not commit.
+    """
+    checkpoints = db.scalars(
+        select(LedgerCheckpoint).where(LedgerCheckpoint.group_id == group.id).order_by(LedgerCheckpoint.cutoff, LedgerCheckpoint.id)
+    )
+    balances: PairDeltas = {}
+    for checkpoint in checkpoints:
+        _add_pair_sums(db, group, balances, Transaction.checkpoint_id == checkpoint.id)
+        checkpoint.balances = _pair_rows(balances)
+    db.flush()
+
+def record_transaction(db: Session, transaction: Transaction, group: Group) -> None:
+    apply_deltas(db, group.id, transaction_deltas(transaction, group.base_currency))
+
+def unrecord_transaction(db: Session, transaction: Transaction, group: Group) -> None:
+    apply_deltas(db, group.id, transaction_deltas(transaction, group.base_currency, sign=-1))
+
+def read_balances(db: Session, group_id: int, user_id: int) -> Dict[int, Decimal]:
+    """
+    Return {other_user_id: amount} for every stored pair that involves user_id.
+    Positive -> the other user owes user_id. Negative -> user_id owes the other user.
+    """
+    stmt = select(GroupBalance.user_a, GroupBalance.user_b, GroupBalance.amount).where(
+        GroupBalance.group_id == group_id,
+        or_(GroupBalance.user_a == user_id, GroupBalance.user_b == user_id),
+    )
+
+    balances: Dict[int, Decimal] = {}
+    for user_a, user_b, amount in db.execute(stmt):
+        if user_a == user_id:
+            balances[user_b] = amount
+        else:
+            balances[user_a] = -amount
+    return balances
+
+def rebuild_group(db: Session, group: Group) -> None:
+    """
+    Drop and recompute every stored balance of a group from its latest checkpoint and its live
+    transactions. Does not commit.
+    """
+    db.execute(delete(GroupBalance).where(GroupBalance.group_id == group.id))
+
+    deltas = checkpoint_pairs(latest_checkpoint(db, group.id))
+    for payer_id, user_id, _, _, converted, _ in pair_currency_sums(db, group):
+        add_to_pair(deltas, payer_id, user_id, converted)
+
+    for (user_a, user_b), amount in deltas.items():
+        if amount:
+            db.add(GroupBalance(group_id=group.id, user_a=user_a, user_b=user_b, amount=amount))
+    db.flush()
+
+def group_pair_balances(db: Session, group: Group, pending_rates: PendingRates) -> PairDeltas:
+    """
+    Every pair balance of a group: the stored ledger plus deferred transactions converted with
+    pending_rates (one rate per key returned by pending_rate_keys).
+    """
+    balances: PairDeltas = {
+        (user_a, user_b): amount
+        for user_a, user_b, amount in db.execute(
+            select(GroupBalance.user_a, GroupBalance.user_b, GroupBalance.amount).where(GroupBalance.group_id == group.id)
+        )
+    }
+
+    if pending_rates:
+        for payer_id, user_id, currency, day, _, unconverted in pair_currency_sums(db, group, pending_only=True):
+            add_to_pair(balances, payer_id, user_id, unconverted * Decimal(str(pending_rates[(currency, day)])))
+
+    return balances
+
+def net_positions(pair_balances: PairDeltas) -> Dict[int, Decimal]:
+    """Collapse pair balances into one number per user. Positive -> the user is owed money overall."""
+    net: Dict[int, Decimal] = {}
+    for (user_a, user_b), amount in pair_balances.items():
+        net[user_a] = net.get(user_a, Decimal(0)) + amount
+        net[user_b] = net.get(user_b, Decimal(0)) - amount
+    return net
+
+def plan_settlement(net: Dict[int, Decimal]) -> List[Transfer]:
+    """
+    Turn net positions into a short list of (from_user_id, to_user_id, amount) transfers.
+
+    Greedy on two max-heaps: the largest debtor always pays the largest creditor, so every
+    step settles at least one person and the plan has at most N - 1 transfers.
+    Runs in O(N log N). Amounts are rounded to cents first so no dust transfers are produced.
+    """
+    creditors: List[Tuple[Decimal, int]] = []
+    debtors: List[Tuple[Decimal, int]] = []
+    for user_id, amount in net.items():
+        amount = amount.quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+        if amount > 0:
+            creditors.append((-amount, user_id))
+        elif amount < 0:
+            debtors.append((amount, user_id))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers: List[Transfer] = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor_id, creditor_id, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+    return transfers
+
+def member_balance_rows(db: Session, user_id: int) -> List[Row]:
+    """
+    The user's stored balances in every active (not archived or deleted) group they are still
+    in, in one aggregated query.
+
+    Rows are (group_id, group_name, base_currency, other_user_id, other_display_name, amount) with
+    amount > 0 meaning the other user owes user_id. Groups without any balance yet come back
+    once with other_user_id None.
+    """
+    counterparty = case((GroupBalance.user_a == user_id, GroupBalance.user_b), else_=GroupBalance.user_a)
+    signed = case((GroupBalance.user_a == user_id, GroupBalance.amount), else_=-GroupBalance.amount)
+
+    stmt = (
+        select(
+            Group.id,
+            Group.name,
+            Group.base_currency,
+            counterparty.label("other_user_id"),
+            User.display_name,
+            type_coerce(func.coalesce(func.sum(signed), 0), Numeric(precision=18, scale=6)).label("amount"),
+        )
+        .join(GroupMember, GroupMember.group_id == Group.id)
+        .outerjoin(
+            GroupBalance,
+            and_(
+                GroupBalance.group_id == Group.id,
+                or_(GroupBalance.user_a == user_id, GroupBalance.user_b == user_id),
+            ),
+        )
+        .outerjoin(User, User.id == counterparty)
+        .where(
+            GroupMember.user_id == user_id,
+            GroupMember.left_at.is_(None),
+            Group.deleted_at.is_(None),
+            Group.is_archived.is_(False),
+        )
+        .group_by(Group.id, Group.name, Group.base_currency, counterparty, User.display_name)
+        .order_by(Group.id)
+    )
+    return list(db.execute(stmt).all())
+
+def member_pending_sums(db: Session, user_id: int, group_ids: List[int]) -> List[Row]:
+    """
+    Deferred-rate split sums involving the user across several groups, pre-summed per
+    (group_id, base_currency, payer_id, user_id, currency, day).
+    """
+    if not group_ids:
+        return []
+
+    stmt = (
+        select(
+            Transaction.group_id,
+            Group.base_currency,
+            Transaction.payer_id,
+            Split.user_id,
+            _pending_currency().label("currency"),
+            _created_day().label("day"),
+            type_coerce(func.sum(_pending_amount(Split.amount_cents)), AMOUNT_TYPE).label("unconverted"),
+        )
+        .join(Split, Split.transaction_id == Transaction.id)
+        .join(Group, Group.id == Transaction.group_id)
+        .where(
+            Transaction.group_id.in_(group_ids),
+            Transaction.payer_id.is_not(None),
+            Transaction.total_in_group_currency.is_(None),
+            Transaction.currency != Group.base_currency,
+            or_(Transaction.payer_id == user_id, Split.user_id == user_id),
+        )
+        .group_by(Transaction.group_id, Group.base_currency, Transaction.payer_id, Split.user_id, _pending_currency(), _created_day())
+    )
+    return list(db.execute(stmt).all())
+
+def pending_rate_keys(db: Session, group: Group) -> List[Tuple[str, date]]:
+    """
+    Distinct (currency, day) of the group's transactions that still need an exchange rate to the
+    base currency; the old base currency for transactions waiting on re-rating.
+    """
+    stmt = (
+        select(_pending_currency(), _created_day())
+        .where(Transaction.group_id == group.id, _is_pending(group))
+        .distinct()
+    )
+    return [(currency, day) for currency, day in db.execute(stmt)]
+
+def groups_with_pending(db: Session) -> List[int]:
+    """Ids of active (not archived or deleted) groups with transactions that still need an exchange rate."""
+    stmt = (
+        select(Transaction.group_id)
+        .join(Group, Group.id == Transaction.group_id)
+        .where(
+            Transaction.total_in_group_currency.is_(None),
+            Transaction.currency != Group.base_currency,
+            Group.is_archived.is_(False),
+            Group.deleted_at.is_(None),
+        )
+        .distinct()
+        .order_by(Transaction.group_id)
+    )
+    return list(db.scalars(stmt))
+
+def resolve_pending(db: Session, group: Group, pending_rates: PendingRates) -> int:
+    """
+    Write the rates of pending_rates onto the group's deferred transactions of that (currency, day),
+    convert them and add them to the ledger and the group's spend. Transactions waiting on
+    re-rating are keyed by their old base and get their old rate times that one.
+    Returns the number resolved. Does not commit.
+    """
+    if not pending_rates:
+        return 0
+    stmt = (
+        select(Transaction)
+        .where(Transaction.group_id == group.id, _is_pending(group))
+        .order_by(Transaction.id)
+    )
+    deltas: PairDeltas = {}
+    spent = Decimal(0)
+    resolved = 0
+    reclosed = False
+    for transaction in db.scalars(stmt).unique():
+        day = transaction.created_at.date() # type: ignore
+        rate = pending_rates.get((transaction.rerate_from or transaction.currency, day))
+        if rate is None:
+            continue
+        if transaction.rerate_from is not None:
+            rate *= transaction.exchange_rate_to_group or 1.0
+            transaction.rerate_from = None # type: ignore
+        transaction.exchange_rate_to_group = rate
+        convert_transaction(transaction, group.base_currency)
+        transaction_deltas(transaction, group.base_currency, deltas=deltas)
+        spent += transaction.total_in_group_currency or Decimal(0)
+        resolved += 1
+        reclosed = reclosed or transaction.checkpoint_id is not None
+
+    apply_deltas(db, group.id, deltas)
+    if reclosed:
+        # closed transactions re-rated after a base change go back into their checkpoint's totals
+        db.flush()
+        rederive_checkpoints(db, group)
+    if spent:
+        group.total_spent_base = Group.total_spent_base + spent # type: ignore
+    return resolved
+
+def balance_matrix(db: Session, group: Group, member_ids: List[int], pending_rates: PendingRates) -> np.ndarray:
+    """
+    Net balances between every pair of members from one aggregated query over the group's splits.
+
+    Returns an N x N float array where result[i][j] is what member_ids[j] owes member_ids[i]
+    in the base currency (so result is antisymmetric). pending_rates must hold a rate for
+    every key returned by pending_rate_keys.
+    """
+    n = len(member_ids)
+    index = {user_id: i for i, user_id in enumerate(member_ids)}
+
+    paid = np.zeros((n, n), dtype=np.float64)
+    # closed periods: user_b owes user_a
+    for (user_a, user_b), amount in checkpoint_pairs(latest_checkpoint(db, group.id)).items():
+        if user_a in index and user_b in index:
+            paid[index[user_a], index[user_b]] += float(amount)
+
+    rows = pair_currency_sums(db, group)
+    if not rows:
+        return paid - paid.T
+
+    payer_ids, debtor_ids, currencies, days, converted, unconverted = zip(*rows)
+    payer_idx = np.fromiter((index.get(user_id, -1) for user_id in payer_ids), dtype=np.intp, count=len(rows))
+    debtor_idx = np.fromiter((index.get(user_id, -1) for user_id in debtor_ids), dtype=np.intp, count=len(rows))
+
+    rates = np.fromiter((pending_rates.get(key, 0.0) for key in zip(currencies, days)), dtype=np.float64, count=len(rows))
+    amounts = np.asarray(converted, dtype=np.float64) + np.asarray(unconverted, dtype=np.float64) * rates
+
+    # rows pointing at users outside the roster cannot be placed
+    valid = (payer_idx >= 0) & (debtor_idx >= 0)
+    np.add.at(paid, (payer_idx[valid], debtor_idx[valid]), amounts[valid])
+
+    # paid[i][j] is what j owes i, paid[j][i] is what i owes j
+    return paid - paid.T
+
+def balance_history(db: Session, group: Group, user_id: int, bucket: str, pending_rates: PendingRates) -> pd.DataFrame:
+    """
+    Running balance between user_id and every other member over time.
+
+    One ordered query over the user's live splits, then a vectorized pass: convert to the base
+    currency, sum per (bucket, other user) and take a cumulative sum per other user. Closed
+    periods contribute one opening row at the bucket of the latest checkpoint's cutoff.
+    Returns a frame indexed by bucket start (only buckets with activity) with one column per
+    other user. Positive -> the other user owes user_id at the end of that bucket.
+    bucket is "day" or "week" (weeks start on Monday).
+    """
+    def bucket_start(values: pd.Series) -> pd.Series:
+        day = pd.to_datetime(values, utc=True).dt.tz_localize(None).dt.floor("D")
+        return day if bucket == "day" else day - pd.to_timedelta(day.dt.weekday, unit="D")
+
+    stmt = (
+        select(
+            Transaction.created_at,
+            Transaction.payer_id,
+            Split.user_id,
+            _pending_amount(Split.amount_cents),
+            Split.amount_in_group_currency,
+            _pending_currency(),
+        )
+        .join(Split, Split.transaction_id == Transaction.id)
+        .where(
+            Transaction.group_id == group.id,
+            _is_live(group),
+            Transaction.payer_id.is_not(None),
+            Split.user_id != Transaction.payer_id,
+            or_(Transaction.payer_id == user_id, Split.user_id == user_id),
+        )
+        .order_by(Transaction.created_at, Transaction.id)
+    )
+    frame = pd.DataFrame(
+        db.execute(stmt).all(),
+        columns=["created_at", "payer_id", "user_id", "amount", "converted", "currency"],
+    )
+
+    checkpoint = latest_checkpoint(db, group.id)
+    opening = {
+        (user_b if user_a == user_id else user_a): float(amount if user_a == user_id else -amount)
+        for (user_a, user_b), amount in checkpoint_pairs(checkpoint).items()
+        if user_id in (user_a, user_b)
+    }
+    if frame.empty and not opening:
+        return pd.DataFrame(dtype=np.float64)
+
+    # stored base-currency amounts, else the amount itself (base currency) or times the pending rate of its day
+    created_day = pd.to_datetime(frame["created_at"], utc=True).dt.date
+    pending_keys = pd.Series(list(zip(frame["currency"], created_day)), index=frame.index, dtype=object)
+    rates = pending_keys.map(lambda key: pending_rates.get(key, np.nan)).where(frame["currency"] != group.base_currency, 1.0)
+    converted = frame["converted"].astype(np.float64).fillna(frame["amount"].astype(np.float64) * rates)
+
+    paid_by_user = frame["payer_id"] == user_id
+    signed = pd.DataFrame({
+        "bucket": bucket_start(frame["created_at"]),
+        "other_user_id": frame["user_id"].where(paid_by_user, frame["payer_id"]),
+        "signed": converted.where(paid_by_user, -converted),
+    })
+    if opening:
+        signed = pd.concat([
+            pd.DataFrame({
+                "bucket": bucket_start(pd.Series([checkpoint.cutoff] * len(opening))), # type: ignore
+                "other_user_id": list(opening),
+                "signed": list(opening.values()),
+            }),
+            signed,
+        ], ignore_index=True)
+
+    per_bucket = signed.pivot_table(index="bucket", columns="other_user_id", values="signed", aggfunc="sum", fill_value=0.0)
+    return per_bucket.sort_index().cumsum()
@@ -1,13 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI
 
 
 from .routers import groups, transactions, auth, users, invites, location
-from .db import engine #, SessionLocal, connection
+from .db import engine, SessionLocal #, connection
+from . import backfill, fx, migrate, outbound, places
 from backend.schema import Base
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import sessionmaker
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # keeps rate sheets fresh, resolves exchange rates that requests deferred and refreshes
+    # expired place lookups
+    fx.start_refresher()
+    backfill.start_worker(SessionLocal)
+    places.start_refresher(SessionLocal)
+    yield
+    places.stop_refresher()
+    backfill.stop_worker()
+    fx.stop_refresher()
+    await outbound.close_async_client()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(auth.router)
 app.include_router(groups.router)
@@ -25,6 +40,8 @@ app.add_middleware(
     
 )
 Base.metadata.create_all(bind=engine)
+migrate.add_missing_columns(engine)
 #Base.metadata.create_all(bind=connection)
 
+
 print(Base.metadata.tables.keys())
\ No newline at end of file
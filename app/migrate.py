@@ -0,0 +1,45 @@
+# app/migrate.py
+"""
+Brings databases created by an older version up to the current schema. Base.metadata.create_all
+only creates missing tables, so columns and indexes added to existing tables (converted amounts,
+checkpoint_id, the group activity counters, rerate_from, the places grid) are added here.
+
+Only additive changes are handled: a new column is added with its server default (NULL when it
+has none) and without its foreign key, which SQLite cannot add to an existing table. Fill the
+new columns afterwards with `python manage.py backfill-converted` and `recount-activity`.
+"""
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+
+from backend.schema import Base
+
+def add_missing_columns(engine: Engine) -> List[str]:
+    """
+    Add columns and indexes of the models that existing tables lack. Returns "table.column"
+    (or the index name) of everything added. Run after create_all.
+    """
+    added = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                table_name = conn.dialect.identifier_preparer.format_table(table)
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    added.append(index.name) # type: ignore
+    return added
@@ -0,0 +1,198 @@
+# app/outbound.py
+"""
+Shared client for calls to third-party APIs (Google OAuth, Geoapify, the FX provider).
+
+One requests.Session keeps a keep-alive connection pool per host. Every call has a deadline,
+idempotent requests are retried with backoff on connection errors and 429/5xx answers, and each
+host gets a small circuit breaker plus a cap on concurrent calls: once a host keeps failing, or
+enough request threads are already waiting on it, further calls fail immediately with
+UpstreamUnavailable instead of holding more threadpool workers.
+
+AsyncOutboundClient offers the same over httpx for async routes and shares the breakers. Tests
+and local stand-in servers plug in through OutboundClient.mount (a requests adapter for a URL
+prefix) or the transport argument of AsyncOutboundClient (eg. httpx.MockTransport).
+"""
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) seconds when a call does not pass its own timeout
+DEFAULT_TIMEOUT: Tuple[float, float] = (3.05, float(os.getenv("OUTBOUND_TIMEOUT", "10")))
+RETRIES = 2
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# keep-alive connections kept per host
+POOL_SIZE = 10
+# calls in flight per host before new ones are refused
+MAX_CONCURRENT_PER_HOST = int(os.getenv("OUTBOUND_MAX_CONCURRENT", "8"))
+# consecutive failures that open a host's breaker, and how long it then stays open
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN_SECONDS = 30.0
+
+Timeout = Union[float, Tuple[float, float]]
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Raised without calling the host: its breaker is open or too many calls are in flight."""
+
+class CircuitBreaker:
+    """
+    Per-host failure counter. Closed while calls succeed; after threshold consecutive failures it
+    opens for cooldown seconds, then lets one trial call through (half open) and closes again on
+    success or reopens on failure. Also caps how many calls to the host run at once.
+    """
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN_SECONDS, max_concurrent: int = MAX_CONCURRENT_PER_HOST):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_concurrent = max_concurrent
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.in_flight = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                if time.monotonic() - self.opened_at < self.cooldown or self._trial:
+                    raise UpstreamUnavailable(f"{host} is unavailable (circuit open)")
+                self._trial = True
+            if self.in_flight >= self.max_concurrent:
+                raise UpstreamUnavailable(f"{host} is unavailable (too many calls in flight)")
+            self.in_flight += 1
+
+    def release(self, ok: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self._trial or self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
+            self._trial = False
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(url: str) -> Tuple[str, CircuitBreaker]:
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker()
+    return host, breaker
+
+def reset_breakers() -> None:
+    with _breakers_lock:
+        _breakers.clear()
+
+def _failed(status_code: int) -> bool:
+    # 4xx answers are the caller's problem, the host itself is fine
+    return status_code >= 500 or status_code == 429
+
+class OutboundClient:
+    """Blocking client for request handlers and worker threads."""
+    def __init__(self, timeout: Timeout = DEFAULT_TIMEOUT, retries: int = RETRIES):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def mount(self, prefix: str, adapter: BaseAdapter) -> None:
+        """Route calls to URLs starting with prefix through adapter (stand-in servers, replay)."""
+        self.session.mount(prefix, adapter)
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None, **kwargs: Any) -> requests.Response:
+        host, breaker = breaker_for(url)
+        breaker.acquire(host)
+        ok = False
+        try:
+            resp = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            ok = not _failed(resp.status_code)
+            return resp
+        finally:
+            breaker.release(ok)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+class AsyncOutboundClient:
+    """httpx based client for async routes; same deadlines, retries and breakers."""
+    def __init__(self, timeout: Timeout = DEFAULT_TIMEOUT, retries: int = RETRIES, transport: Optional[httpx.AsyncBaseTransport] = None):
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        self.retries = retries
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_keepalive_connections=POOL_SIZE),
+            transport=transport,
+        )
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        host, breaker = breaker_for(url)
+        breaker.acquire(host)
+        ok = False
+        attempts = self.retries + 1 if method in ("GET", "HEAD") else 1
+        try:
+            attempt = 0
+            while True:
+                last = attempt == attempts - 1
+                try:
+                    resp = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError:
+                    if last:
+                        raise
+                else:
+                    if last or resp.status_code not in RETRY_STATUSES:
+                        ok = not _failed(resp.status_code)
+                        return resp
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                attempt += 1
+        finally:
+            breaker.release(ok)
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+# process-wide clients; callers go through the module attribute so tests can swap them
+client = OutboundClient()
+async_client: Optional[AsyncOutboundClient] = None
+
+def get_async_client() -> AsyncOutboundClient:
+    """The shared async client, created on first use (it binds to the running event loop's pool)."""
+    global async_client
+    if async_client is None:
+        async_client = AsyncOutboundClient()
+    return async_client
+
+async def close_async_client() -> None:
+    global async_client
+    if async_client is not None:
+        await async_client.aclose()
+        async_client = None
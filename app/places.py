@@ -0,0 +1,439 @@
+# app/places.py
+"""
+Cache of Geoapify place lookups per city.
+
+Rows of the places_cache table are keyed by a normalized city name, so "Tokyo", "tokyo" and
+"Tokyo " share one row and one upstream fetch. A bounded in-process TTL cache sits in front of
+the table: popular cities are served from memory without a database round trip. Its TTL is
+short next to CACHE_TTL so a row refreshed by another worker is picked up soon.
+
+Expired entries are still served right away (stale-while-revalidate): the first request to see
+one schedules a single background refresh that fetches the places again and persists the row,
+so lookups never wait on Geoapify for a city that was fetched before.
+
+Fetches are single-flight per city key: within a process a per-key lock lets one thread call
+Geoapify while the others wait for its result, and across server processes a row in
+places_leases does the same (waiters poll for the cache row until the lease holder wrote it,
+or its lease expired).
+
+Names are geocoded once and kept in geocode_cache. Entries are also indexed by a lon/lat grid:
+a name whose point lies within PLACES_RADIUS_METERS of an already fetched entry reuses that
+entry's places, so neighborhood names and alternate spellings cost no places call.
+
+Only the fields the app shows are kept from a Geoapify FeatureCollection (see project), so rows,
+cache hits and responses carry a short list of flat dicts instead of the raw GeoJSON. Rows
+written before that still hold the raw answer and are projected when read.
+"""
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import logging
+import math
+import os
+import socket
+import threading
+import time
+
+import dotenv
+from cachetools import TTLCache
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import outbound
+from backend.schema import GeocodeCache, PlacesCache, PlacesLease
+
+dotenv.load_dotenv(dotenv.find_dotenv())
+
+logger = logging.getLogger(__name__)
+
+GEOAPIFY_KEY = os.getenv("GEOAPIFY_KEY")
+GEOAPIFY_URL = "https://api.geoapify.com/v2/places"
+GEOCODE_URL = "https://api.geoapify.com/v1/geocode/search"
+PLACE_CATEGORIES = "tourism,entertainment,leisure.park,building.tourism"
+PLACES_RADIUS_METERS = 5000
+PLACES_LIMIT = 20
+
+# how long a stored Geoapify answer is used before it is fetched again
+CACHE_TTL = timedelta(days=5)
+# cities do not move, geocoded points are kept much longer
+GEOCODE_TTL = timedelta(days=90)
+# grid cell size in degrees; a cell is ~5.6 km high so a 5 km circle spans at most 3 rows
+GRID_DEGREES = 0.05
+EARTH_RADIUS_METERS = 6371000.0
+MEMORY_CACHE_SIZE = int(os.getenv("PLACES_MEMORY_CACHE_SIZE", "512"))
+MEMORY_CACHE_TTL_SECONDS = int(os.getenv("PLACES_MEMORY_CACHE_TTL", "600"))
+# background refreshes running at once
+REFRESH_WORKERS = 2
+# how long a fetch may hold a city before others take over, and how long others wait for it
+LEASE_SECONDS = 30
+LEASE_WAIT_SECONDS = 15
+LEASE_POLL_SECONDS = 0.2
+
+# identifies this process in places_leases
+_HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+# one place as stored and served, see project
+Place = Dict[str, Any]
+
+def _place(feature: dict) -> Place:
+    properties = feature.get("properties") or {}
+    place = {
+        "name": properties.get("name"),
+        "name_en": (properties.get("name_international") or {}).get("en"),
+        "address": properties.get("formatted"),
+        "categories": properties.get("categories") or [],
+        "website": properties.get("website"),
+        "opening_hours": properties.get("opening_hours"),
+        "lon": properties.get("lon"),
+        "lat": properties.get("lat"),
+    }
+    return {field: value for field, value in place.items() if value is not None}
+
+def project(response: Any) -> List[Place]:
+    """Compact places of a Geoapify FeatureCollection; already projected lists pass through."""
+    if isinstance(response, list):
+        return response
+    return [_place(feature) for feature in (response or {}).get("features", [])]
+
+class CachedPlaces(NamedTuple):
+    key: str  # city key of the row the places were fetched for
+    response: List[Place]
+    lon: str
+    lat: str
+    updated_at: datetime
+
+    @property
+    def fresh(self) -> bool:
+        return datetime.now(timezone.utc) - self.updated_at < CACHE_TTL
+
+_memory: TTLCache = TTLCache(maxsize=MEMORY_CACHE_SIZE, ttl=MEMORY_CACHE_TTL_SECONDS)
+_memory_lock = threading.Lock()
+
+def city_key(city: str) -> str:
+    """Cache key of a city name: trimmed, inner whitespace collapsed, case folded."""
+    return " ".join(city.split()).casefold()
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def _entry(row: PlacesCache) -> CachedPlaces:
+    return CachedPlaces(row.city, project(row.response), row.lon, row.lat, _as_utc(row.updated_at))
+
+def remember(key: str, entry: CachedPlaces) -> CachedPlaces:
+    """Keep entry in memory under key (its own key, or a name that reuses it)."""
+    with _memory_lock:
+        _memory[key] = entry
+    return entry
+
+def lookup(db: Session, key: str) -> Optional[CachedPlaces]:
+    """
+    Cached places of a city key: from memory, else its row, else the entry near its already
+    geocoded point. None if that needs an upstream call.
+    """
+    with _memory_lock:
+        entry = _memory.get(key)
+    if entry is not None:
+        if entry.key != key and not entry.fresh:
+            # a name reusing another entry: its refresh is remembered under that entry's key
+            current = lookup(db, entry.key)
+            if current is not None and current.updated_at > entry.updated_at:
+                entry = remember(key, current)
+        return entry
+    row = db.get(PlacesCache, key)
+    if row is not None:
+        return remember(key, _entry(row))
+    point = db.get(GeocodeCache, key)
+    if point is not None and _fresh_point(point):
+        entry = nearest(db, point.lon, point.lat)
+        if entry is not None:
+            return remember(key, entry)
+    return None
+
+def grid_cell(lon: float, lat: float) -> Tuple[int, int]:
+    return math.floor(lon / GRID_DEGREES), math.floor(lat / GRID_DEGREES)
+
+def distance_meters(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """Great-circle (haversine) distance between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+def nearest(db: Session, lon: float, lat: float, radius: float = PLACES_RADIUS_METERS) -> Optional[CachedPlaces]:
+    """
+    The stored entry closest to a point, if it lies within radius meters. Only the grid cells
+    the circle can reach are read (more columns towards the poles, where cells get narrower).
+    Does not wrap around the antimeridian.
+    """
+    cell_x, cell_y = grid_cell(lon, lat)
+    span_y = math.ceil(radius / (GRID_DEGREES * math.pi / 180 * EARTH_RADIUS_METERS))
+    cell_width = GRID_DEGREES * math.pi / 180 * EARTH_RADIUS_METERS * math.cos(math.radians(min(abs(lat) + GRID_DEGREES * span_y, 89.9)))
+    span_x = min(math.ceil(radius / cell_width), math.ceil(360 / GRID_DEGREES))
+    rows = db.scalars(
+        select(PlacesCache).where(
+            PlacesCache.grid_y.between(cell_y - span_y, cell_y + span_y),
+            PlacesCache.grid_x.between(cell_x - span_x, cell_x + span_x),
+        )
+    )
+    best, best_distance = None, radius
+    for row in rows:
+        distance = distance_meters(lon, lat, float(row.lon), float(row.lat))
+        if distance <= best_distance:
+            best, best_distance = row, distance
+    return _entry(best) if best is not None else None
+
+def _fresh_point(point: GeocodeCache) -> bool:
+    return datetime.now(timezone.utc) - _as_utc(point.updated_at) < GEOCODE_TTL
+
+def geocode_cached(db: Session, key: str, city: str) -> Optional[GeocodeCache]:
+    """Geocoded point of a city key, asking Geoapify only if it is not stored yet. Commits."""
+    point = db.get(GeocodeCache, key)
+    if point is not None and _fresh_point(point):
+        return point
+    feature = geocode(city)
+    if feature is None:
+        return None
+    values = dict(
+        lon=float(feature["lon"]), lat=float(feature["lat"]),
+        place_id=feature.get("place_id"), updated_at=datetime.now(timezone.utc),
+    )
+    try:
+        if point is None:
+            point = GeocodeCache(name=key, **values)
+            db.add(point)
+        else:
+            for field, value in values.items():
+                setattr(point, field, value)
+        db.commit()
+    except IntegrityError:
+        # another process geocoded the same name, use its row
+        db.rollback()
+        point = db.get(GeocodeCache, key)
+    return point
+
+def store(db: Session, key: str, response: List[Place], lon: str, lat: str) -> PlacesCache:
+    """Insert or update the row of a city key. Does not commit; remember the row once committed."""
+    row = db.get(PlacesCache, key)
+    if row is None:
+        row = PlacesCache(city=key)
+        db.add(row)
+    row.response = response
+    row.lon = lon
+    row.lat = lat
+    row.grid_x, row.grid_y = grid_cell(float(lon), float(lat))
+    row.updated_at = datetime.now(timezone.utc)
+    return row
+
+def save(db: Session, key: str, response: List[Place], lon: str, lat: str) -> CachedPlaces:
+    """
+    store and commit, then remember. If another process inserted the row in between, its
+    insert wins the primary key and the row is updated instead.
+    """
+    try:
+        row = store(db, key, response, lon, lat)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        row = store(db, key, response, lon, lat)
+        db.commit()
+    return remember(key, _entry(row))
+
+def compact(db: Session) -> int:
+    """
+    Tidy rows written by older versions: project raw Geoapify answers, fill missing grid cells
+    and move rows stored under a raw city name to its key. Of several rows sharing a key the
+    one already under the key, else the newest, is kept. Returns the number of rows rewritten
+    or removed. Does not commit.
+    """
+    rows = list(db.scalars(select(PlacesCache)))
+    rows.sort(key=lambda row: (row.city != city_key(row.city), -_as_utc(row.updated_at).timestamp()))
+    kept = set()
+    changed = 0
+    for row in rows:
+        key = city_key(row.city)
+        if key in kept or not key:
+            db.delete(row)
+            changed += 1
+            continue
+        kept.add(key)
+        if row.city == key and isinstance(row.response, list) and row.grid_x is not None:
+            continue
+        row.city = key
+        row.response = project(row.response)
+        row.grid_x, row.grid_y = grid_cell(float(row.lon), float(row.lat))
+        changed += 1
+    return changed
+
+_key_locks: Dict[str, List[Any]] = {}  # key -> [lock, users]
+_key_locks_guard = threading.Lock()
+
+@contextmanager
+def _key_lock(key: str, blocking: bool = True) -> Iterator[bool]:
+    """Hold the in-process lock of a city key; yields False if blocking is off and it is taken."""
+    with _key_locks_guard:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    acquired = entry[0].acquire(blocking)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            entry[0].release()
+        with _key_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[key]
+
+def acquire_lease(db: Session, key: str) -> bool:
+    """Claim the fetch of a city key for this process, taking over an expired lease. Commits."""
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=LEASE_SECONDS)
+    try:
+        db.add(PlacesLease(city=key, holder=_HOLDER, expires_at=expires_at))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+    result = db.execute(
+        update(PlacesLease)
+        .where(PlacesLease.city == key, PlacesLease.expires_at < now)
+        .values(holder=_HOLDER, expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1 # type: ignore
+
+def release_lease(db: Session, key: str) -> None:
+    db.execute(
+        delete(PlacesLease)
+        .where(PlacesLease.city == key, PlacesLease.holder == _HOLDER)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def _stored(db: Session, key: str) -> Optional[CachedPlaces]:
+    """The table row of a key as committed right now, skipping memory and the session's copy."""
+    row = db.get(PlacesCache, key, populate_existing=True)
+    return remember(key, _entry(row)) if row is not None else None
+
+def single_flight(db: Session, key: str, load: Callable[[], Tuple[CachedPlaces, bool]]) -> Tuple[CachedPlaces, bool]:
+    """
+    Cached places of a city key, calling load() -> (entry, fetched) only if no other thread or
+    process is already loading it. Returns the entry and whether this call fetched it.
+    Exceptions of load propagate to this caller only; waiters then load themselves.
+    """
+    with _key_lock(key):
+        # filled by the thread we waited for
+        cached = lookup(db, key)
+        if cached is not None:
+            return cached, False
+
+        deadline = time.monotonic() + LEASE_WAIT_SECONDS
+        while not acquire_lease(db, key):
+            cached = _stored(db, key)
+            if cached is not None:
+                return cached, False
+            if time.monotonic() > deadline:
+                # the holder is stuck, do not keep the user waiting on it
+                logger.warning("Gave up waiting for the places lease of %r", key)
+                break
+            time.sleep(LEASE_POLL_SECONDS)
+        else:
+            # the previous holder may have finished right before we got the lease
+            cached = _stored(db, key)
+            if cached is not None:
+                release_lease(db, key)
+                return cached, False
+
+        try:
+            return load()
+        finally:
+            release_lease(db, key)
+
+def clear_memory() -> None:
+    with _memory_lock:
+        _memory.clear()
+
+def _geoapify_get(url: str, params: dict) -> dict:
+    """GET a Geoapify endpoint; raises requests.RequestException on failure."""
+    resp = outbound.client.get(url, params={**params, "apiKey": GEOAPIFY_KEY})
+    resp.raise_for_status()
+    return resp.json()
+
+def geocode(city: str) -> Optional[dict]:
+    """Properties of the best city match for a name (lon, lat, place_id...), None if there is none."""
+    data = _geoapify_get(GEOCODE_URL, {"text": city, "type": "city", "limit": 1})
+    if not data.get("features"):
+        return None
+    return data["features"][0]["properties"]
+
+def fetch_places(lon: Any, lat: Any) -> List[Place]:
+    """Places around a point, projected from the Geoapify FeatureCollection."""
+    return project(_geoapify_get(GEOAPIFY_URL, {
+        "filter": f"circle:{lon},{lat},{PLACES_RADIUS_METERS}",
+        "categories": PLACE_CATEGORIES,
+        "limit": PLACES_LIMIT,
+    }))
+
+class Refresher:
+    """Runs background refreshes of expired entries, at most one per city key at a time."""
+    def __init__(self, session_factory: Callable[[], Session], workers: int = REFRESH_WORKERS):
+        self.session_factory = session_factory
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="places-refresh")
+        self._running: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, key: str, lon: str, lat: str) -> bool:
+        """Queue a refresh of key unless one is already queued or running. True if queued."""
+        with self._lock:
+            if key in self._running:
+                return False
+            self._running[key] = self._executor.submit(self._refresh, key, lon, lat)
+            return True
+
+    def _refresh(self, key: str, lon: str, lat: str) -> None:
+        db = self.session_factory()
+        try:
+            # a lookup or another process is already fetching this city
+            with _key_lock(key, blocking=False) as acquired:
+                if acquired and acquire_lease(db, key):
+                    try:
+                        # another process refreshed the row since the stale copy was read
+                        current = _stored(db, key)
+                        if current is None or not current.fresh:
+                            save(db, key, fetch_places(lon, lat), lon, lat)
+                    finally:
+                        release_lease(db, key)
+        except Exception:
+            db.rollback()
+            logger.exception("Refreshing places of %r failed", key)
+        finally:
+            db.close()
+            with self._lock:
+                self._running.pop(key, None)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+refresher: Optional[Refresher] = None
+
+def start_refresher(session_factory: Callable[[], Session]) -> Refresher:
+    """Start the process-wide refresher once."""
+    global refresher
+    if refresher is None:
+        refresher = Refresher(session_factory)
+    return refresher
+
+def stop_refresher(wait: bool = False) -> None:
+    global refresher
+    if refresher is not None:
+        refresher.shutdown(wait)
+        refresher = None
+
+def request_refresh(entry: CachedPlaces) -> None:
+    """Refresh an expired entry in the background. No-op when the refresher is not running."""
+    if refresher is not None:
+        refresher.schedule(entry.key, entry.lon, entry.lat)
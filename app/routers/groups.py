@@ -1,19 +1,28 @@
 # app/routers/groups.py
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from decimal import Decimal
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import Dict, List, Optional
-from .transactions import get_exchange_rate
+from typing import Dict, List, Literal, Optional, Tuple
+from app.fx import get_exchange_rate
 
 from backend.schema import Group, GroupMember, User
 from app.deps import get_db, get_current_user
+from app import activity, backfill, ledger, snapshots
 from app.schema import (
+    BalanceHistoryOut,
+    BalanceMatrixOut,
+    BalancePointOut,
+    ClosePeriodIn,
     CreateGroupIn,
     GroupDuesOut,
     GroupOut,
     IndividualDueOut,
+    LedgerCheckpointOut,
     MemberOut,
+    SettlementTransferOut,
+    SettleUpOut,
     UpdateGroupIn,
     CreateMemberIn,
 )
@@ -49,6 +58,23 @@ def _require_active_group(group: Group | None, enforce_archive: bool = False):
     elif enforce_archive and group.is_archived:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Group is archived")
 
+def _resolve_pending_rates(db: Session, group: Group) -> Optional[ledger.PendingRates]:
+    """One exchange rate per (currency, day) of the group's deferred transactions, None if any lookup fails"""
+    pending_rates = {}
+    for currency, day in ledger.pending_rate_keys(db, group):
+        rate = get_exchange_rate(transaction_currency=currency, group_currency=group.base_currency, db=db, on=day, fetch=False, store=False)
+        if rate is None:
+            backfill.request_run()
+            return None
+        pending_rates[(currency, day)] = rate
+    return pending_rates
+
+def _pending_rates(db: Session, group: Group) -> ledger.PendingRates:
+    pending_rates = _resolve_pending_rates(db, group)
+    if pending_rates is None:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_CONTENT, "Exchange rate failure")
+    return pending_rates
+
 @router.post("/groups", response_model=GroupOut, status_code=status.HTTP_201_CREATED, tags=["groups"])
 def create_group(
     payload: CreateGroupIn,
@@ -67,6 +93,8 @@ def create_group(
         location_lat=payload.location_lat,
         location_lon=payload.location_lon,
         created_by=current_user.id,
+        member_count=1,
+        last_activity_at=datetime.now(timezone.utc),
     )
     db.add(group)
     db.flush()  # assign group.id
@@ -105,12 +133,25 @@ def update_group(
     _require_active_group(group, True)
     _require_admin(db, group_id, current_user.id)
 
+    old_base_currency = group.base_currency # type: ignore
     for field, value in payload.model_dump(exclude_unset=True).items():
         if value is not None:
             setattr(group, field, value)
+
+    # stored amounts, checkpoints and balances are in the old base currency. Rated transactions
+    # are deferred until the background job re-rates them to the new base in bulk
+    rebased = group.base_currency != old_base_currency # type: ignore
+    if rebased:
+        ledger.mark_rerate(db, group, old_base_currency) # type: ignore
+        ledger.convert_group(db, group) # type: ignore
+        ledger.rederive_checkpoints(db, group) # type: ignore
+        ledger.rebuild_group(db, group) # type: ignore
+        activity.recount(db, group_id)
     
     db.commit()
     db.refresh(group)
+    if rebased:
+        backfill.request_run()
 
     return GroupOut.model_validate(group)
 
@@ -132,6 +173,12 @@ def archive_group(
     _require_active_group(group)
     _require_admin(db, group_id, current_user.id)
     group.is_archived = True # type: ignore
+
+    # the group cannot change anymore, freeze its read models. If a deferred exchange rate
+    # cannot be resolved right now the reads just keep being computed live
+    pending_rates = _resolve_pending_rates(db, group) # type: ignore
+    if pending_rates is not None:
+        snapshots.store_snapshot(db, group, pending_rates) # type: ignore
     db.commit()
 
     return None
@@ -151,6 +198,7 @@ def unarchive_group(
     _require_active_group(group)
     _require_admin(db, group_id, current_user.id)
     group.is_archived = False # type: ignore
+    group.snapshot = None # type: ignore
     db.commit()
 
     return None
@@ -193,35 +241,50 @@ def get_current_dues(
     _require_member(db, group_id, current_user.id)
     _require_active_group(group, False)
 
-    dues = {(membership.user_id) : [Decimal("0.00"), membership.user.display_name] for membership in group.members if membership.user_id != current_user.id} # type: ignore
+    if group.is_archived and group.snapshot is not None: # type: ignore
+        dues = snapshots.snapshot_dues(group.snapshot, current_user.id) # type: ignore
+        return [
+            IndividualDueOut(other_user_id=user_id, other_user_display_name=name, amount_owed=amount)
+            for user_id, (amount, name) in dues.items()
+        ]
+
+    members = db.execute(
+        select(GroupMember.user_id, User.display_name)
+        .join(User, User.id == GroupMember.user_id)
+        .where(GroupMember.group_id == group_id, GroupMember.user_id != current_user.id)
+    ).all()
+    dues = {user_id : [Decimal("0.00"), display_name] for user_id, display_name in members}
+
+    # everything with a known rate is already summed in the ledger
+    for user_id, amount in ledger.read_balances(db, group_id, current_user.id).items():
+        dues[user_id][0] += amount
+
+    # transactions whose exchange rate was deferred are not in the ledger yet.
+    # Bucket their pre-summed amounts per (currency, day) and counterparty first...
+    buckets: Dict[Tuple[str, date], Dict[int, Decimal]] = {}
+    for payer_id, user_id, currency, day, _, unconverted in ledger.pair_currency_sums(db, group, current_user.id, pending_only=True): # type: ignore
+        if payer_id == user_id:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid split; contains self")
+
+        # the current user paid, the other user owes them
+        if payer_id == current_user.id:
+            other_user_id, amount = user_id, unconverted
+        # the current user is in the splits of someone else's transaction
+        else:
+            other_user_id, amount = payer_id, -unconverted
 
-    for transaction in group.transactions: # type: ignore
-        #TODO if there is a rate, then multiply all cents with rate
-        # is the payer, then add all the values
-        multiplier = Decimal(1)
-        if transaction.exchange_rate_to_group is not None and (transaction.currency != group.base_currency): # type: ignore
-            multiplier = Decimal(str(transaction.exchange_rate_to_group))
+        bucket = buckets.setdefault((currency, day), {})
+        bucket[other_user_id] = bucket.get(other_user_id, Decimal(0)) + amount
 
-        elif transaction.exchange_rate_to_group is None and (transaction.currency != group.base_currency): # type: ignore
-            # this means the exhcange rate issue was deferred since there was some issue when creating
-            multiplier = Decimal(str(get_exchange_rate(transaction_currency=transaction.currency, group_currency=group.base_currency))) # type: ignore
-        
-        if multiplier is None:
+    # ...then convert every bucket with a single lookup of the rate of that day
+    for (currency, day), bucket in buckets.items():
+        rate = get_exchange_rate(transaction_currency=currency, group_currency=group.base_currency, db=db, on=day, fetch=False, store=False) # type: ignore
+        if rate is None:
+            backfill.request_run()
             raise HTTPException(status.HTTP_422_UNPROCESSABLE_CONTENT, "Exchange rate failure")
-        
-        if transaction.payer_id == current_user.id:
-            for split in transaction.splits:
-                if split.user_id == current_user.id:
-                    raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid split; contains self")
-                (dues[split.user_id][0]) += split.amount_cents * multiplier
-        
-        # not the payer, see if they are in the splits
-        else:
-            for split in transaction.splits:
-                # if the user is in the split
-                if split.user_id == current_user.id:
-                    dues[transaction.payer_id][0] -= split.amount_cents * multiplier
-                    break
+        multiplier = Decimal(str(rate))
+        for other_user_id, amount in bucket.items():
+            dues[other_user_id][0] += amount * multiplier
 
     list_of_dues: List[IndividualDueOut] = [
         IndividualDueOut(
@@ -232,6 +295,124 @@ def get_current_dues(
     for user_id in dues.keys()]
     return list_of_dues
 
+@router.get("/groups/{group_id}/balances", response_model=BalanceMatrixOut, tags=["groups"])
+def get_balance_matrix(
+    group_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return the full member x member net balance matrix of a group, computed in one batched pass
+    """
+    group = db.get(Group, group_id)
+    _require_member(db, group_id, current_user.id)
+    _require_active_group(group, False)
+
+    member_ids = list(db.scalars(
+        select(GroupMember.user_id).where(GroupMember.group_id == group_id).order_by(GroupMember.user_id)
+    ))
+
+    matrix = ledger.balance_matrix(db, group, member_ids, _pending_rates(db, group)) # type: ignore
+    return BalanceMatrixOut(
+        group_id=group_id,
+        base_currency=group.base_currency, # type: ignore
+        member_ids=member_ids,
+        balances=[[Decimal(f"{amount:.2f}") + 0 for amount in row] for row in matrix.tolist()],
+    )
+
+@router.get("/groups/{group_id}/balances/history", response_model=BalanceHistoryOut, tags=["groups"])
+def get_balance_history(
+    group_id: int,
+    bucket: Literal["day", "week"] = Query("day", description="Bucket size of the time series"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return the current user's running balance with each other member, one point per day or week with activity
+    """
+    group = db.get(Group, group_id)
+    _require_member(db, group_id, current_user.id)
+    _require_active_group(group, False)
+
+    history = ledger.balance_history(db, group, current_user.id, bucket, _pending_rates(db, group)) # type: ignore
+    points = [
+        BalancePointOut(
+            bucket_start=bucket_start.to_pydatetime(),
+            balances={int(other_user_id): Decimal(f"{amount:.2f}") + 0 for other_user_id, amount in row.items()},
+        )
+        for bucket_start, row in history.iterrows()
+    ]
+    return BalanceHistoryOut(group_id=group_id, base_currency=group.base_currency, bucket=bucket, points=points) # type: ignore
+
+@router.get("/groups/{group_id}/settle-up", response_model=SettleUpOut, tags=["groups"])
+def get_settle_up_plan(
+    group_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return a minimal list of payments that settles every balance in the group
+    """
+    group = db.get(Group, group_id)
+    _require_member(db, group_id, current_user.id)
+    _require_active_group(group, False)
+
+    pair_balances = ledger.group_pair_balances(db, group, _pending_rates(db, group)) # type: ignore
+    transfers = ledger.plan_settlement(ledger.net_positions(pair_balances))
+
+    return SettleUpOut(
+        group_id=group_id,
+        base_currency=group.base_currency, # type: ignore
+        transfers=[
+            SettlementTransferOut(from_user_id=from_user_id, to_user_id=to_user_id, amount=amount)
+            for from_user_id, to_user_id, amount in transfers
+        ],
+    )
+
+@router.post("/groups/{group_id}/close-period", response_model=LedgerCheckpointOut, status_code=status.HTTP_201_CREATED, tags=["groups"])
+def close_period(
+    group_id: int,
+    payload: ClosePeriodIn,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Close the books up to a cutoff (admin only). Balances up to the cutoff are stored in a checkpoint
+    and the transactions it covers can no longer be edited or deleted. Transactions still waiting on
+    an exchange rate stay open. Returns a 400 if the cutoff is in the future or not after the last one
+    """
+    group = db.get(Group, group_id)
+    _require_active_group(group, True)
+    _require_admin(db, group_id, current_user.id)
+
+    now = datetime.now(timezone.utc)
+    cutoff = payload.cutoff or now
+    # transactions are stored in UTC, so compare (and store) the cutoff in UTC too
+    if cutoff.tzinfo is None:
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+    else:
+        cutoff = cutoff.astimezone(timezone.utc)
+    if cutoff > now:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Cutoff cannot be in the future")
+
+    previous = ledger.latest_checkpoint(db, group_id)
+    if previous is not None:
+        previous_cutoff = previous.cutoff if previous.cutoff.tzinfo else previous.cutoff.replace(tzinfo=timezone.utc)
+        if cutoff <= previous_cutoff:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Cutoff must be after the last closed period")
+
+    checkpoint, closed = ledger.close_period(db, group, cutoff, current_user.id) # type: ignore
+    db.commit()
+    db.refresh(checkpoint)
+
+    return LedgerCheckpointOut(
+        id=checkpoint.id,
+        group_id=group_id,
+        cutoff=checkpoint.cutoff,
+        created_at=checkpoint.created_at,
+        closed_transactions=closed,
+    )
+
 # Member stuff
 @router.post("/groups/{group_id}/members", response_model=MemberOut, tags=["members"])
 def add_member(
@@ -270,6 +451,7 @@ def add_member(
         gm = GroupMember(group_id=group_id, user_id=user.id, is_admin=payload.make_admin)
         db.add(gm)
 
+    group.record_activity(members=1) # type: ignore
     db.commit()
     db.refresh(gm)
 
@@ -295,6 +477,9 @@ def list_non_left_members(
     _require_active_group(group)
     _require_member(db, group_id, current_user.id)
 
+    if group.is_archived and group.snapshot is not None: # type: ignore
+        return [m for m in group.snapshot.members if m["left_at"] is None] # type: ignore
+
     members = db.query(GroupMember).filter(GroupMember.group_id == group_id).all()
     return [
         MemberOut(
@@ -321,6 +506,9 @@ def list_all_members(
     _require_active_group(group)
     _require_member(db, group_id, current_user.id)
 
+    if group.is_archived and group.snapshot is not None: # type: ignore
+        return group.snapshot.members # type: ignore
+
     members = db.query(GroupMember).filter(GroupMember.group_id == group_id).all()
     return [
         MemberOut(
@@ -358,6 +546,7 @@ def remove_member(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Membership not found")
 
     gm.left_at = datetime.now(timezone.utc) # type: ignore
+    group.record_activity(members=-1) # type: ignore
     db.flush()
     db.commit()
 
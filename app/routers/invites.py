@@ -60,7 +60,7 @@ def join_group(
     
     # Check if group still exists
     group = db.get(Group, group_id)
-    if not group or group.deleted_at is not None:
+    if not group or group.deleted_at is not None or group.is_archived:
         raise HTTPException(status_code=404, detail="Group not found or archived")
     
     gm = (
@@ -82,6 +82,7 @@ def join_group(
         gm = GroupMember(group_id=group_id, user_id=current_user.id, is_admin=False)
         db.add(gm)
 
+    group.record_activity(members=1)
     db.commit()
     db.refresh(gm)
 
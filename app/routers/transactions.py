@@ -1,17 +1,18 @@
 # app/routers/transactions.py
-from datetime import datetime, timezone
+from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
-from fastapi import APIRouter, Depends, HTTPException, Query, status, FastAPI
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, FastAPI
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import select
 from typing import List, Optional, Set
-from pathlib import Path
-import requests
-import json
-import os
+import csv
+import io
 
 from backend.schema import Transaction, User, Split, Group, GroupMember
 from app.deps import get_db, get_current_user
+from app import backfill, ledger, snapshots
+from app.fx import get_exchange_rate
 from app.schema import (
     SplitIn,
     SplitOut,
@@ -23,66 +24,6 @@ from app.schema import (
 TWO_PLACES = Decimal(10) ** -2
 router = APIRouter(tags=["transactions"])
 
-def get_exchange_rate(transaction_currency: str, group_currency: str):
-    if transaction_currency == group_currency:
-        return None
-    
-    # first check if the exchange has already been cached, note that exchange rate goes both ways so either
-    # currency will be fine
-    trans_path = Path(f"../exchange_cache/{transaction_currency}.json")
-    group_path = Path(f"../exchange_cache/{group_currency}.json")
-
-    if trans_path.exists():
-        with open(trans_path, "r") as f:
-            exchange_data = json.load(f)
-
-        now = int(datetime.now(timezone.utc).timestamp())
-
-        # if its still valid
-        if int(exchange_data["time_next_update_unix"]) > now:
-            return float(exchange_data["rates"][group_currency])
-        
-        # else move onto the group path instead
-
-    if group_path.exists():
-        with open(group_path, "r") as f:
-            exchange_data = json.load(f)
-
-        now = int(datetime.now(timezone.utc).timestamp())
-
-        # if its still valid
-        if int(exchange_data["time_next_update_unix"]) > now:
-            return (1.0 / float(exchange_data["rates"][group_currency]))
-        
-    os.makedirs(os.path.dirname(trans_path), exist_ok=True)
-    # making
-    trans_resp = requests.get(f"https://open.er-api.com/v6/latest/{transaction_currency}")
-    if trans_resp.status_code == 200:
-        # save the resp
-        transaction_data = trans_resp.json()
-        assert transaction_data["result"] == "success"
-
-        with open(trans_path, "w") as f:
-            json.dump(transaction_data, f, ensure_ascii=False, indent=4)
-        
-        return float(transaction_data["rates"][group_currency]) 
-    
-    # try the other one if this fails too
-
-    group_resp = requests.get(f"https://open.er-api.com/v6/latest/{transaction_currency}")
-    if group_resp.status_code == 200:
-        # save the resp
-        group_data = group_resp.json()
-        assert group_data["result"] == "success"
-
-        with open(group_path, "w") as f:
-            json.dump(group_data, f, ensure_ascii=False, indent=4)
-        
-        return (1.0 / float(group_data["rates"][group_currency]))
-    
-    # unable to request, defer to a different time
-    return None
-
 def _verify_splits(payload: CreateTransactionIn | UpdateTransactionIn, user_ids_in_group: Set[int], payer_id: int):
     if payload.splits is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Must provide splits")
@@ -188,9 +129,11 @@ def create_transaction(
     group_user_ids = _get_all_users_in_group(db, group_id, True)
     _verify_splits(payload, group_user_ids, payload.payer_id)
 
-    # get transaction rate
+    # get transaction rate from stored or cached sheets only, the backfill worker resolves misses later
     if group.base_currency != payload.currency and payload.exchange_rate_to_group is None: # type: ignore
-        exchange_rate = get_exchange_rate(payload.currency, group.base_currency) # type: ignore
+        exchange_rate = get_exchange_rate(payload.currency, group.base_currency, db=db, fetch=False) # type: ignore
+        if exchange_rate is None:
+            backfill.request_run()
     else:
         exchange_rate = None
         
@@ -214,8 +157,11 @@ def create_transaction(
 
         splits = splits
     )
+    ledger.convert_transaction(t, group.base_currency) # type: ignore
 
     db.add(t)
+    ledger.record_transaction(db, t, group) # type: ignore
+    group.record_activity(transactions=1, spent=t.total_in_group_currency) # type: ignore
     db.commit()
     db.refresh(t)
     return t
@@ -223,6 +169,7 @@ def create_transaction(
 @router.get("/groups/{group_id}/transactions", response_model=List[TransactionOut])
 def get_all_transactions(
     group_id: int,
+    response: Response,
     start_date: Optional[datetime] = Query(None, description="Filter transactions created after this date"),
     end_date: Optional[datetime] = Query(None, description="Filter transactions created before this date"),
     payer_id: Optional[int] = Query(None),
@@ -232,9 +179,21 @@ def get_all_transactions(
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
+    """
+    One page of the group's transactions, newest first. Unfiltered listings carry the total number of
+    transactions in the X-Total-Count header
+    """
     group = db.get(Group, group_id)
     _require_member(db, group_id, current_user.id)
     _require_active_group(group, False)
+
+    if not (start_date or end_date or payer_id or creator_id):
+        response.headers["X-Total-Count"] = str(group.transaction_count) # type: ignore
+
+    # archived groups never change, serve the frozen pages
+    if group.is_archived and group.snapshot is not None: # type: ignore
+        return snapshots.snapshot_transactions(group.snapshot, start_date, end_date, payer_id, creator_id, limit, offset) # type: ignore
+
     stmt = (
         select(Transaction)
         .options(
@@ -259,6 +218,48 @@ def get_all_transactions(
 
     return transactions
 
+EXPORT_COLUMNS = [
+    "transaction_id", "created_at", "title", "payer_id", "creator_id", "currency",
+    "total_amount_cents", "exchange_rate_to_group", "split_user_id", "split_amount_cents", "split_note",
+]
+
+@router.get("/groups/{group_id}/transactions/export")
+def export_transactions(
+    group_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Stream every transaction of the group as CSV, one row per split, oldest first.
+    Memory use is bounded by the ledger chunk size, not by the size of the group
+    """
+    group = db.get(Group, group_id)
+    _require_member(db, group_id, current_user.id)
+    _require_active_group(group, False)
+
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for chunk in ledger.iter_transaction_chunks(db, group_id):
+            for transaction, splits in chunk:
+                for split in splits:
+                    writer.writerow([
+                        transaction.id, transaction.created_at, transaction.title, transaction.payer_id,
+                        transaction.creator_id, transaction.currency, transaction.total_amount_cents,
+                        transaction.exchange_rate_to_group, split.user_id, split.amount_cents, split.note,
+                    ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="group_{group_id}_transactions.csv"'},
+    )
+
 # get specific transaction
 @router.get("/transactions/{transaction_id}", response_model=TransactionOut)
 def get_transaction(
@@ -324,7 +325,13 @@ def update_transaction(
     
     if membership.is_admin is False and transaction.creator_id != current_user.id:
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Must be admin or creator")
+    if transaction.checkpoint_id is not None:
+        raise HTTPException(status.HTTP_409_CONFLICT, "Transaction is in a closed period")
     
+    # capture what the old version contributed to the ledger before anything changes
+    deltas = ledger.transaction_deltas(transaction, group.base_currency, sign=-1)
+    old_total = transaction.total_in_group_currency or Decimal(0)
+
     # first update scalar data
     scalar_data = payload.model_dump(exclude={"splits"}, exclude_unset=True)
     for field, value in scalar_data.items():
@@ -352,6 +359,11 @@ def update_transaction(
 
         transaction.splits = new_splits
 
+    # amount, currency or rate may have changed, so store the converted amounts again
+    ledger.convert_transaction(transaction, group.base_currency)
+    ledger.transaction_deltas(transaction, group.base_currency, deltas=deltas)
+    ledger.apply_deltas(db, group_id, deltas)
+    group.record_activity(spent=(transaction.total_in_group_currency or Decimal(0)) - old_total)
     db.commit()
     db.refresh(transaction)
 
@@ -379,6 +391,10 @@ def delete_transaction(
 
     if membership.is_admin is False and transaction.creator_id != current_user.id:
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Must be admin or creator")
+    if transaction.checkpoint_id is not None:
+        raise HTTPException(status.HTTP_409_CONFLICT, "Transaction is in a closed period")
+    ledger.unrecord_transaction(db, transaction, group)
+    group.record_activity(transactions=-1, spent=-(transaction.total_in_group_currency or Decimal(0)))
     db.delete(transaction)
     db.commit()
 
@@ -1,14 +1,20 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
+from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException, status, FastAPI
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import exists, select, update
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from backend.schema import Transaction, User, Split, Group, GroupMember
 from app.deps import get_db, get_current_user
+from app import backfill, ledger, snapshots
+from app.fx import get_exchange_rate
 from app.schema import (
+    CounterpartyNetOut,
     EditUserIn,
+    GroupNetOut,
+    MyBalancesOut,
     SplitIn,
     SplitOut,
     CreateTransactionIn,
@@ -45,6 +51,16 @@ def _require_active_group(group: Group | None, enforce_archive: bool = False):
     elif enforce_archive and group.is_archived:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Group is archived")
 
+def _refresh_snapshots(db: Session, user_id: int) -> None:
+    """Archived groups serve their roster and names from a snapshot, keep those of a user in sync."""
+    archived = db.scalars(
+        select(Group)
+        .join(GroupMember, GroupMember.group_id == Group.id)
+        .where(GroupMember.user_id == user_id, Group.is_archived.is_(True))
+    ).unique()
+    for group in archived:
+        snapshots.refresh_members(db, group)
+
 @router.get("/me", response_model=UserOut)
 def get_me(
     db: Session = Depends(get_db),
@@ -91,6 +107,65 @@ def get_my_groups(
     )
     return db.scalars(stmt).all()
 
+@router.get("/me/balances", response_model=MyBalancesOut)
+def get_my_balances(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Returns the current user's net position in every active group they are in, plus a total per other user
+    across groups (one total per base currency). Raises a 404 if the user is marked for deletion
+    """
+    if current_user.is_deleted():
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "User has been deleted")
+
+    groups: Dict[int, GroupNetOut] = {}
+    # (other_user_id, currency) -> [net, display_name]
+    counterparties: Dict[Tuple[int, str], list] = {}
+
+    def add(group_id: int, base_currency: str, other_user_id: int, display_name: Optional[str], amount: Decimal):
+        groups[group_id].net += amount
+        entry = counterparties.setdefault((other_user_id, base_currency), [Decimal("0.00"), display_name])
+        entry[0] += amount
+        entry[1] = entry[1] or display_name
+
+    for group_id, group_name, base_currency, other_user_id, display_name, amount in ledger.member_balance_rows(db, current_user.id):
+        if group_id not in groups:
+            groups[group_id] = GroupNetOut(group_id=group_id, group_name=group_name, base_currency=base_currency, net=Decimal("0.00"))
+        if other_user_id is not None:
+            add(group_id, base_currency, other_user_id, display_name, amount)
+
+    # deferred transactions are not in the ledger yet, convert them once per currency pair and day
+    rates: Dict[Tuple[str, str, date], Optional[float]] = {}
+    for group_id, base_currency, payer_id, user_id, currency, day, unconverted in ledger.member_pending_sums(db, current_user.id, list(groups)):
+        if (currency, base_currency, day) not in rates:
+            rates[(currency, base_currency, day)] = get_exchange_rate(transaction_currency=currency, group_currency=base_currency, db=db, on=day, fetch=False, store=False)
+        rate = rates[(currency, base_currency, day)]
+        if rate is None:
+            backfill.request_run()
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_CONTENT, "Exchange rate failure")
+
+        amount = unconverted * Decimal(str(rate))
+        if payer_id == current_user.id and user_id != current_user.id:
+            add(group_id, base_currency, user_id, None, amount)
+        elif payer_id != current_user.id:
+            add(group_id, base_currency, payer_id, None, -amount)
+
+    # other users only seen in deferred transactions still need a display name
+    missing = {other_user_id for (other_user_id, _), (_, name) in counterparties.items() if name is None}
+    if missing:
+        names = dict(db.execute(select(User.id, User.display_name).where(User.id.in_(missing))).all())
+        for (other_user_id, _), entry in counterparties.items():
+            entry[1] = entry[1] or names.get(other_user_id)
+
+    return MyBalancesOut(
+        groups=list(groups.values()),
+        counterparties=[
+            CounterpartyNetOut(other_user_id=other_user_id, other_user_display_name=display_name, currency=currency, net=net)
+            for (other_user_id, currency), (net, display_name) in counterparties.items()
+        ],
+    )
+
 @router.post("/create-user", response_model=UserOut)
 def create_user(
     payload: CreateUserIn,
@@ -144,6 +219,15 @@ def delete_user(
     current_user.anonymize()
 
     current_time = datetime.now(timezone.utc)
+    # the groups this user still counts towards lose a member
+    db.execute(
+        update(Group)
+        .where(Group.id.in_(
+            select(GroupMember.group_id).where(GroupMember.user_id == current_user.id, GroupMember.left_at.is_(None))
+        ))
+        .values(member_count=Group.member_count - 1, last_activity_at=current_time)
+        .execution_options(synchronize_session=False)
+    )
     stmt = (
         update(GroupMember)
         .where(GroupMember.user_id == current_user.id)
@@ -151,6 +235,8 @@ def delete_user(
         .execution_options(synchronize_session=False)
     )
     db.execute(stmt)
+
+    _refresh_snapshots(db, current_user.id)
     db.commit()
     db.refresh(current_user)
 
@@ -166,10 +252,14 @@ def edit_user(
     if current_user.deleted_at is not None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User has been deleted")
 
+    old_name = current_user.display_name
     for field, value in payload.model_dump(exclude_unset=True).items():
         if value is not None:
             setattr(current_user, field, value)
 
+    if current_user.display_name != old_name:
+        db.flush()
+        _refresh_snapshots(db, current_user.id)
     db.commit()
     db.refresh(current_user)
     return current_user
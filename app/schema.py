@@ -1,7 +1,7 @@
 from typing import Dict, List, Optional, Annotated
 from pydantic import AnyHttpUrl, BaseModel, Field, EmailStr, field_validator, ConfigDict
 from datetime import datetime
-from pydantic_extra_types.currency_code import Currency
+from app.currencies import Currency
 from decimal import Decimal
 from backend.schema import Group
 
@@ -56,6 +56,10 @@ class GroupOut(BaseModel):
     creator_display_name: Optional[str]
     location_name: Optional[str]
     is_archived: bool
+    member_count: int = 0
+    transaction_count: int = 0
+    total_spent_base: Decimal = Decimal(0)
+    last_activity_at: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -74,6 +78,67 @@ class IndividualDueOut(BaseModel):
     other_user_display_name: str
     amount_owed: Decimal
 
+class GroupNetOut(BaseModel):
+    """Net position of the current user in one group. Positive -> the others owe the current user."""
+    group_id: int
+    group_name: str
+    base_currency: str
+    net: Decimal
+
+class CounterpartyNetOut(BaseModel):
+    """Net position against one other user summed across groups that share a base currency."""
+    other_user_id: int
+    other_user_display_name: Optional[str]
+    currency: str
+    net: Decimal
+
+class MyBalancesOut(BaseModel):
+    groups: List[GroupNetOut]
+    counterparties: List[CounterpartyNetOut]
+
+class BalanceMatrixOut(BaseModel):
+    """
+    Net balances between every pair of members, in the group's base currency.
+    balances[i][j] > 0 -> member_ids[j] owes member_ids[i]. Amounts are rounded to 2 places.
+    """
+    group_id: int
+    base_currency: str
+    member_ids: List[int]
+    balances: List[List[Decimal]]
+
+class BalancePointOut(BaseModel):
+    """Running balance with each other member at the end of a bucket. Positive -> they owe the current user."""
+    bucket_start: datetime
+    balances: Dict[int, Decimal]
+
+class BalanceHistoryOut(BaseModel):
+    group_id: int
+    base_currency: str
+    bucket: str
+    points: List[BalancePointOut]
+
+class SettlementTransferOut(BaseModel):
+    """One payment of the settle-up plan: from_user pays to_user amount (base currency)."""
+    from_user_id: int
+    to_user_id: int
+    amount: Decimal
+
+class SettleUpOut(BaseModel):
+    group_id: int
+    base_currency: str
+    transfers: List[SettlementTransferOut]
+
+class ClosePeriodIn(BaseModel):
+    """Close every transaction created up to cutoff (defaults to now)."""
+    cutoff: Optional[datetime] = None
+
+class LedgerCheckpointOut(BaseModel):
+    id: int
+    group_id: int
+    cutoff: datetime
+    created_at: datetime
+    closed_transactions: int
+
 # Member in/out
 class CreateMemberIn(BaseModel):
     user_id: int
@@ -189,4 +254,23 @@ class TransactionOut(BaseModel):
 #    model_config = ConfigDict(from_attributes=True)
 
 class InviteOut(BaseModel):
-    invite_link: AnyHttpUrl
\ No newline at end of file
+    invite_link: AnyHttpUrl
+# Places
+class PlaceOut(BaseModel):
+    """One point of interest near a group's location, projected from Geoapify."""
+    name: Optional[str] = None
+    name_en: Optional[str] = None
+    address: Optional[str] = None
+    categories: List[str] = []
+    website: Optional[str] = None
+    opening_hours: Optional[str] = None
+    lon: Optional[float] = None
+    lat: Optional[float] = None
+
+class PlacesOut(BaseModel):
+    """
+    Places of a city. source tells where they came from: geoapify, cache, nearby (reused from
+    an entry within 5 km) or stale (expired, a refresh is running).
+    """
+    source: str
+    places: List[PlaceOut]
@@ -0,0 +1,149 @@
+# app/snapshots.py
+"""
+Frozen snapshots of archived groups.
+
+An archived group can no longer change, so its dues, member roster and transaction list are
+computed once when it is archived and served from the group_snapshots table afterwards.
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import ledger
+from app.schema import MemberOut, TransactionOut
+from backend.schema import Group, GroupMember, GroupSnapshot, User
+
+def _member_rows(db: Session, group_id: int) -> List[Dict[str, Any]]:
+    stmt = (
+        select(GroupMember, User.display_name)
+        .join(User, User.id == GroupMember.user_id)
+        .where(GroupMember.group_id == group_id)
+        .order_by(GroupMember.id)
+        .execution_options(populate_existing=True)
+    )
+    return [
+        MemberOut(
+            user_id=m.user_id,
+            group_id=m.group_id,
+            display_name=display_name,
+            joined_at=m.joined_at.isoformat(), # type: ignore
+            left_at=m.left_at.isoformat() if m.left_at else None, # type: ignore
+            is_admin=m.is_admin,
+        ).model_dump(mode="json")
+        for m, display_name in db.execute(stmt)
+    ]
+
+def _transaction_rows(db: Session, group_id: int, names: Dict[int, Optional[str]]) -> List[Dict[str, Any]]:
+    """Serialized TransactionOut rows plus created_at, newest first."""
+    rows = []
+    for chunk in ledger.iter_transaction_chunks(db, group_id):
+        for transaction, splits in chunk:
+            row = TransactionOut(
+                id=transaction.id,
+                group_id=transaction.group_id,
+                creator_id=transaction.creator_id,
+                creator_display_name=names.get(transaction.creator_id) or "",
+                payer_id=transaction.payer_id,
+                payer_display_name=names.get(transaction.payer_id) or "",
+                total_amount_cents=transaction.total_amount_cents,
+                currency=transaction.currency,
+                exchange_rate_to_group=transaction.exchange_rate_to_group,
+                title=transaction.title,
+                memo=transaction.memo,
+                splits=[
+                    {
+                        "user_id": split.user_id,
+                        "user_display_name": names.get(split.user_id) or "",
+                        "amount_cents": split.amount_cents,
+                        "note": split.note,
+                    }
+                    for split in splits
+                ],
+            ).model_dump(mode="json")
+            row["created_at"] = transaction.created_at.isoformat() # type: ignore
+            rows.append(row)
+    rows.reverse()
+    return rows
+
+def store_snapshot(db: Session, group: Group, pending_rates: ledger.PendingRates) -> GroupSnapshot:
+    """
+    Build and attach the snapshot of a group. pending_rates freezes the conversion of any
+    transaction still waiting on an exchange rate. Does not commit.
+    """
+    members = _member_rows(db, group.id)
+    names = {member["user_id"]: member["display_name"] for member in members}
+    balances = ledger.group_pair_balances(db, group, pending_rates)
+
+    snapshot = GroupSnapshot(
+        group_id=group.id,
+        balances=[[user_a, user_b, str(amount)] for (user_a, user_b), amount in balances.items() if amount],
+        members=members,
+        transactions=_transaction_rows(db, group.id, names),
+    )
+    group.snapshot = snapshot
+    return snapshot
+
+def refresh_members(db: Session, group: Group) -> None:
+    """
+    Re-read the roster of a snapshot and the names in its transaction rows (eg. after a member
+    renamed or deleted their account). Does not commit.
+    """
+    if group.snapshot is None:
+        return
+    members = _member_rows(db, group.id)
+    names = {member["user_id"]: member["display_name"] for member in members}
+    transactions = []
+    for row in group.snapshot.transactions:
+        row = dict(
+            row,
+            creator_display_name=names.get(row["creator_id"]) or "",
+            payer_display_name=names.get(row["payer_id"]) or "",
+            splits=[dict(split, user_display_name=names.get(split["user_id"]) or "") for split in row["splits"]],
+        )
+        transactions.append(row)
+    group.snapshot.members = members
+    group.snapshot.transactions = transactions
+
+def snapshot_dues(snapshot: GroupSnapshot, user_id: int) -> Dict[int, List[Any]]:
+    """{other_user_id: [amount, display_name]} for user_id, same convention as get_current_dues."""
+    dues = {
+        member["user_id"]: [Decimal("0.00"), member["display_name"]]
+        for member in snapshot.members if member["user_id"] != user_id
+    }
+    for user_a, user_b, amount in snapshot.balances:
+        if user_a == user_id:
+            dues[user_b][0] += Decimal(amount)
+        elif user_b == user_id:
+            dues[user_a][0] -= Decimal(amount)
+    return dues
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def snapshot_transactions(
+    snapshot: GroupSnapshot,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    payer_id: Optional[int] = None,
+    creator_id: Optional[int] = None,
+    limit: int = 10,
+    offset: int = 0,
+) -> List[Dict[str, Any]]:
+    """One page of the frozen transaction list, with the same filters as get_all_transactions."""
+    rows = snapshot.transactions
+    if start_date or end_date:
+        start = _as_utc(start_date) if start_date else None
+        end = _as_utc(end_date) if end_date else None
+        rows = [
+            row for row in rows
+            if (start is None or _as_utc(datetime.fromisoformat(row["created_at"])) >= start)
+            and (end is None or _as_utc(datetime.fromisoformat(row["created_at"])) <= end)
+        ]
+    if payer_id:
+        rows = [row for row in rows if row["payer_id"] == payer_id]
+    if creator_id:
+        rows = [row for row in rows if row["creator_id"] == creator_id]
+    return rows[offset:offset + limit]
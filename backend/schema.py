@@ -1,11 +1,11 @@
 # models.py
 from __future__ import annotations
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from decimal import Decimal
-from typing import List, Optional
+from typing import Any, List, Optional
 from pydantic import EmailStr
 from sqlalchemy import (
-    JSON, Integer, String, Boolean, DateTime, ForeignKey, Text, func, Index, event, Numeric
+    JSON, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, Text, func, Index, event, Numeric
 )
 from sqlalchemy.orm import (
     DeclarativeBase, Mapped, mapped_column, relationship
@@ -75,10 +75,19 @@ class Group(Base):
 
     members: Mapped[List["GroupMember"]] = relationship("GroupMember", back_populates="group", cascade="all, delete-orphan")
     transactions: Mapped[List["Transaction"]] = relationship("Transaction", back_populates="group", cascade="all, delete-orphan")
+    balances: Mapped[List["GroupBalance"]] = relationship("GroupBalance", back_populates="group", cascade="all, delete-orphan")
+    snapshot: Mapped[Optional["GroupSnapshot"]] = relationship("GroupSnapshot", back_populates="group", cascade="all, delete-orphan", uselist=False)
+    checkpoints: Mapped[List["LedgerCheckpoint"]] = relationship("LedgerCheckpoint", back_populates="group", cascade="all, delete-orphan", order_by="LedgerCheckpoint.cutoff")
 
     is_archived: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="0")
     deleted_at: Mapped[Optional[DateTime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
+    # activity counters, kept up to date by the write paths (see record_activity)
+    member_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")  # members who have not left
+    transaction_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    total_spent_base: Mapped[Decimal] = mapped_column(Numeric(precision=18, scale=6), nullable=False, server_default="0")  # converted transactions only
+    last_activity_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
     creator: Mapped[Optional["User"]] = relationship("User", lazy="joined")
 
     @property
@@ -88,6 +97,19 @@ class Group(Base):
     def archive(self) -> None:
         self.is_archived = True
 
+    def record_activity(self, members: int = 0, transactions: int = 0, spent: Optional[Decimal] = None) -> None:
+        """
+        Adjust the activity counters by the given deltas and bump last_activity_at. The increments
+        are SQL expressions applied on flush, so concurrent writers do not overwrite each other.
+        """
+        if members:
+            self.member_count = Group.member_count + members # type: ignore
+        if transactions:
+            self.transaction_count = Group.transaction_count + transactions # type: ignore
+        if spent:
+            self.total_spent_base = Group.total_spent_base + spent # type: ignore
+        self.last_activity_at = datetime.now(timezone.utc)
+
     def soft_delete(self):
         self.deleted_at = datetime.now(timezone.utc)  # type: ignore
 
@@ -141,6 +163,13 @@ class Transaction(Base):
     total_amount_cents: Mapped[Decimal] = mapped_column(Numeric(precision=18, scale=6), nullable=False)
     currency: Mapped[str] = mapped_column(String(3), nullable=True, server_default="USD") 
     exchange_rate_to_group: Mapped[Optional[float]] = mapped_column(nullable=True)
+    # converted once when the rate is resolved, NULL while the rate is deferred
+    total_in_group_currency: Mapped[Optional[Decimal]] = mapped_column(Numeric(precision=18, scale=6), nullable=True)
+    # old base currency exchange_rate_to_group is still relative to after the group's base changed,
+    # NULL once the re-rating job moved it to the current base
+    rerate_from: Mapped[Optional[str]] = mapped_column(String(3), nullable=True)
+    # set once the transaction is folded into a closed period, NULL while it is live
+    checkpoint_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("ledger_checkpoints.id", ondelete="SET NULL"), nullable=True)
 
     group: Mapped["Group"] = relationship("Group", back_populates="transactions")
     creator: Mapped[Optional["User"]] = relationship("User", back_populates="transactions_created", foreign_keys=[creator_id])
@@ -155,6 +184,10 @@ class Transaction(Base):
     def payer_display_name(self) -> Optional[str]:
         return self.payer.display_name if self.payer else None
     
+    __table_args__ = (
+        Index("ix_transaction_group_checkpoint", "group_id", "checkpoint_id"),
+    )
+
     def __repr__(self):
         return f"<Transaction id={self.id} group={self.group_id} total={self.total_amount_cents}>"
 
@@ -170,6 +203,7 @@ class Split(Base):
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
 
     amount_cents: Mapped[Decimal] = mapped_column(Numeric(precision=18, scale=6), nullable=False)  # owed by user for this transaction
+    amount_in_group_currency: Mapped[Optional[Decimal]] = mapped_column(Numeric(precision=18, scale=6), nullable=True)  # NULL while the rate is deferred
     is_payer: Mapped[bool] = mapped_column(Boolean, server_default="0", nullable=False) 
     note: Mapped[Optional[str]] = mapped_column(String(400), nullable=True)
 
@@ -185,11 +219,130 @@ class Split(Base):
         Index("ux_transaction_user", "transaction_id", "user_id", unique=True),
     )
 
+# --- Balances ---
+class GroupBalance(Base):
+    """
+    Running net balance between two members of a group, in the group's base currency.
+    Each pair is stored once with user_a < user_b. Positive amount means user_b owes user_a.
+    """
+    __tablename__ = "group_balances"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    group_id: Mapped[int] = mapped_column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_a: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_b: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Numeric(precision=18, scale=6), nullable=False, server_default="0")
+
+    group: Mapped["Group"] = relationship("Group", back_populates="balances")
+
+    __table_args__ = (
+        Index("ux_group_balance_pair", "group_id", "user_a", "user_b", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<GroupBalance group={self.group_id} {self.user_b} owes {self.user_a} {self.amount}>"
+
+class GroupSnapshot(Base):
+    """
+    Frozen read-only view of an archived group: pair balances, member roster and the
+    serialized transaction list (newest first). Written on archive, dropped on unarchive.
+    """
+    __tablename__ = "group_snapshots"
+
+    group_id: Mapped[int] = mapped_column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    # [[user_a, user_b, amount], ...] with the same convention as GroupBalance
+    balances: Mapped[list] = mapped_column(JSON, nullable=False)
+    members: Mapped[list] = mapped_column(JSON, nullable=False)
+    transactions: Mapped[list] = mapped_column(JSON, nullable=False)
+
+    group: Mapped["Group"] = relationship("Group", back_populates="snapshot")
+
+class LedgerCheckpoint(Base):
+    """
+    Closed accounting period of a group: every pair balance from the transactions up to
+    cutoff, in the group's base currency. Checkpoints are cumulative, so balance reads start
+    from the latest one and only replay transactions that are not folded into it.
+    """
+    __tablename__ = "ledger_checkpoints"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    group_id: Mapped[int] = mapped_column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False, index=True)
+    cutoff: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    created_by: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    # [[user_a, user_b, amount], ...] with the same convention as GroupBalance
+    balances: Mapped[list] = mapped_column(JSON, nullable=False)
+
+    group: Mapped["Group"] = relationship("Group", back_populates="checkpoints")
+
+    def __repr__(self):
+        return f"<LedgerCheckpoint id={self.id} group={self.group_id} cutoff={self.cutoff}>"
+
+class FxRate(Base):
+    """
+    One quote of a provider rate sheet: 1 unit of base is worth rate units of quote on rate_date
+    (the day the provider published the sheet). Rows are only ever added, so a conversion looked
+    up for a given day always gives the same answer.
+    """
+    __tablename__ = "fx_rates"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    rate_date: Mapped[date] = mapped_column(Date, nullable=False)
+    base: Mapped[str] = mapped_column(String(3), nullable=False)
+    quote: Mapped[str] = mapped_column(String(3), nullable=False)
+    rate: Mapped[float] = mapped_column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ux_fx_rate_date_pair", "rate_date", "base", "quote", unique=True),
+        Index("ix_fx_rate_quote_date", "quote", "rate_date"),
+    )
+
+    def __repr__(self):
+        return f"<FxRate {self.rate_date} 1 {self.base} = {self.rate} {self.quote}>"
+
 class PlacesCache(Base):
     __tablename__ = "places_cache"
 
     city: Mapped[str] = mapped_column(String, primary_key=True)
-    response: Mapped[dict] = mapped_column(JSON)
+    # projected places (see app/places.py); older rows hold the raw Geoapify FeatureCollection
+    response: Mapped[Any] = mapped_column(JSON)
     lon: Mapped[str] = mapped_column(String)
     lat: Mapped[str] = mapped_column(String)
-    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # grid cell of (lon, lat), see app/places.py, to find entries near a point
+    grid_x: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    grid_y: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_places_cache_grid", "grid_y", "grid_x"),
+    )
+
+class GeocodeCache(Base):
+    """Geocoded point of a normalized city name, so every spelling is only geocoded once."""
+    __tablename__ = "geocode_cache"
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    lon: Mapped[float] = mapped_column(Float, nullable=False)
+    lat: Mapped[float] = mapped_column(Float, nullable=False)
+    place_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<GeocodeCache {self.name} at {self.lon},{self.lat}>"
+
+class PlacesLease(Base):
+    """
+    Claim of one server process on fetching a city's places, so concurrent lookups in other
+    workers wait for its row instead of calling Geoapify too. Expired leases can be taken over.
+    """
+    __tablename__ = "places_leases"
+
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+    holder: Mapped[str] = mapped_column(String(100), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<PlacesLease {self.city} held by {self.holder} until {self.expires_at}>"
@@ -0,0 +1,30 @@
+# benchmarks/bench_settle_up.py
+"""
+Time the settle-up planner on large event groups. Run from the repository root:
+
+    python -m benchmarks.bench_settle_up
+"""
+import random
+import time
+from decimal import Decimal
+
+from app.ledger import plan_settlement
+
+def random_positions(members: int, seed: int = 0) -> dict[int, Decimal]:
+    rng = random.Random(seed)
+    net = {user_id: Decimal(rng.randint(-100000, 100000)) / 100 for user_id in range(1, members)}
+    net[members] = -sum(net.values())
+    return net
+
+def main() -> None:
+    for members in (50, 500, 5000):
+        net = random_positions(members)
+        runs = 20
+        start = time.perf_counter()
+        for _ in range(runs):
+            transfers = plan_settlement(net)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / runs
+        print(f"{members:>5} members: {len(transfers):>5} transfers in {elapsed_ms:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import { Landmark, Clapperboard, PartyPopper } from "lucide-react";
 
-export const LocationCard: React.FC<{ place_name: string, en_name: string | null,  address: string, categories: string[], website: string, hours: string }> = ({ place_name, en_name, address, categories, website, hours }) => {
+export const LocationCard: React.FC<{ place_name: string, en_name: string | null,  address: string, categories: string[], website?: string, hours?: string }> = ({ place_name, en_name, address, categories, website, hours }) => {
   const hasTourism = categories.some(c => c.includes("tourism"));
   const hasEntertainment = categories.some(c => c.includes("entertainment"));
   const hasLeisure = categories.some(c => c.includes("leisure"));
@@ -2,10 +2,11 @@ import { api, apiFetch } from "@/utils/api_util";
 import { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
  import { LocationCard } from "./LocationCard";
+import type { Place } from "../utils/types";
 
 export const LocationList: React.FC<{ location_name: string}> = ({location_name}) => {
   const [loading, setLoading] = useState(true);
-  const [locationInfo, setLocationInfo] = useState(undefined)
+  const [locationInfo, setLocationInfo] = useState<Place[]>([])
   const nav = useNavigate()
 
   const load = async () => {
@@ -16,7 +17,7 @@ export const LocationList: React.FC<{ location_name: string}> = ({location_name}
 
     try {
       const res = await apiFetch(`/places/${location_name}`);
-      setLocationInfo(res.data.features)
+      setLocationInfo(res.places)
       
     } catch (err) {
       nav("/error", { state: { message: err instanceof Error ? err.message : String(err) } });
@@ -45,13 +46,13 @@ export const LocationList: React.FC<{ location_name: string}> = ({location_name}
     <div>
       <div className="text-center text-4xl text-gray-950 font-bold mb-2">Things To Do: {location_name}</div>
       <div className="flex flex-wrap gap-10 justify-center">
-        {locationInfo.map((location) => <LocationCard key={location.properties.formatted} 
-          place_name={location.properties.name} 
-          en_name={"name_international" in location.properties ? location.properties.name_international.en : null}
-          address={location.properties.formatted}
-          categories={location.properties.categories}
-          website={location.properties.website}
-          hours={location.properties.opening_hours} />
+        {locationInfo.map((place) => <LocationCard key={place.address} 
+          place_name={place.name} 
+          en_name={place.name_en ?? null}
+          address={place.address}
+          categories={place.categories}
+          website={place.website}
+          hours={place.opening_hours} />
         )}
         </div>
     </div>
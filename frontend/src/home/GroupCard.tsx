@@ -113,6 +113,9 @@ export const GroupCard: React.FC<GroupInfo> = ({ group, me }) => {
         {group.location_name && <div className="flex items-center">
           Destination: {group.location_name}
         </div>}
+        <div className="flex items-center">
+          {group.member_count} members · {group.transaction_count} transactions
+        </div>
       </div>
       <div className="text-md text-black border-t border-gray-200 pt-3 mt-2">Description: {group.description ? group.description : "No description"}</div>
       {/* <button onClick={goToEdit}>Edit</button> */}
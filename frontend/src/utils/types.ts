@@ -13,6 +13,10 @@ export interface Group {
   creator_display_name?: string;
   location_name?: string;
   is_archived: boolean;
+  member_count: number;
+  transaction_count: number;
+  total_spent_base: string;
+  last_activity_at?: string | null;
 }
 
 export interface Member {
@@ -45,6 +49,17 @@ export interface Due {
   amount_owed: string;
 }
 
+export interface Place {
+  name: string;
+  name_en?: string;
+  address: string;
+  categories: string[];
+  website?: string;
+  opening_hours?: string;
+  lon?: number;
+  lat?: number;
+}
+
 export interface Split extends SplitInput{
   user_id: number;
   user_display_name: string | null;
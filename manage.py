@@ -0,0 +1,167 @@
+# manage.py
+"""
+Maintenance commands for the backend database. Run from the repository root:
+
+    python manage.py rebuild-ledger              # every group
+    python manage.py rebuild-ledger --group-id 3 # a single group
+    python manage.py build-snapshots             # archived groups without a snapshot
+    python manage.py backfill-converted          # store base-currency amounts, then rebuild
+    python manage.py recount-activity            # recompute the group activity counters
+    python manage.py backfill-rates              # resolve deferred exchange rates once
+    python manage.py compact-places              # tidy places_cache rows of older versions
+"""
+import argparse
+from typing import List, Optional
+
+from sqlalchemy import select
+
+from app import activity, backfill, ledger, migrate, places, snapshots
+from app.db import SessionLocal, engine
+from app.fx import get_exchange_rate
+from backend.schema import Base, Group, GroupSnapshot
+
+def rebuild_ledger(group_id: Optional[int] = None) -> int:
+    """Recompute the stored pairwise balances. Returns the number of groups rebuilt."""
+    db = SessionLocal()
+    try:
+        stmt = select(Group.id).order_by(Group.id)
+        if group_id is not None:
+            stmt = stmt.where(Group.id == group_id)
+
+        group_ids = list(db.scalars(stmt))
+        for gid in group_ids:
+            group = db.get(Group, gid)
+            ledger.rebuild_group(db, group) # type: ignore
+            # one commit per group keeps each rebuild small and independent
+            db.commit()
+        return len(group_ids)
+    finally:
+        db.close()
+
+def backfill_converted(group_id: Optional[int] = None) -> int:
+    """
+    Fill the stored base-currency amounts of transactions written before they existed, then
+    rebuild the ledger from them. Returns the number of groups converted.
+    """
+    db = SessionLocal()
+    try:
+        stmt = select(Group.id).order_by(Group.id)
+        if group_id is not None:
+            stmt = stmt.where(Group.id == group_id)
+
+        group_ids = list(db.scalars(stmt))
+        for gid in group_ids:
+            group = db.get(Group, gid)
+            ledger.convert_group(db, group) # type: ignore
+            ledger.rebuild_group(db, group) # type: ignore
+            db.commit()
+        return len(group_ids)
+    finally:
+        db.close()
+
+def recount_activity(group_id: Optional[int] = None) -> int:
+    """Recompute member/transaction counters and spend of groups. Returns the number of groups updated."""
+    db = SessionLocal()
+    try:
+        count = activity.recount(db, group_id)
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+def backfill_rates() -> int:
+    """Resolve deferred exchange rates, the same pass the server's worker runs. Returns the number resolved."""
+    db = SessionLocal()
+    try:
+        return backfill.backfill_rates(db)
+    finally:
+        db.close()
+
+def compact_places() -> int:
+    """
+    Bring places_cache rows of older versions up to date (see places.compact). Returns the
+    number of rows rewritten or removed.
+    """
+    db = SessionLocal()
+    try:
+        changed = places.compact(db)
+        db.commit()
+        return changed
+    finally:
+        db.close()
+
+def build_snapshots() -> int:
+    """Snapshot archived groups that were archived before snapshots existed. Returns the number built."""
+    db = SessionLocal()
+    try:
+        stmt = (
+            select(Group.id)
+            .outerjoin(GroupSnapshot, GroupSnapshot.group_id == Group.id)
+            .where(Group.is_archived.is_(True), Group.deleted_at.is_(None), GroupSnapshot.group_id.is_(None))
+            .order_by(Group.id)
+        )
+        built = 0
+        for gid in list(db.scalars(stmt)):
+            group = db.get(Group, gid)
+            pending_rates = {}
+            for currency, day in ledger.pending_rate_keys(db, group): # type: ignore
+                rate = get_exchange_rate(currency, group.base_currency, db=db, on=day) # type: ignore
+                if rate is None:
+                    print(f"Skipping group {gid}: no exchange rate for {currency} on {day}")
+                    break
+                pending_rates[(currency, day)] = rate
+            else:
+                snapshots.store_snapshot(db, group, pending_rates) # type: ignore
+                db.commit()
+                built += 1
+        return built
+    finally:
+        db.close()
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="split_pay maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-ledger", help="Recompute pairwise balances from transactions")
+    rebuild.add_argument("--group-id", type=int, default=None, help="Only rebuild this group")
+
+    commands.add_parser("build-snapshots", help="Snapshot archived groups that do not have one yet")
+
+    backfill_parser = commands.add_parser("backfill-converted", help="Store base-currency amounts for existing transactions")
+    backfill_parser.add_argument("--group-id", type=int, default=None, help="Only backfill this group")
+
+    recount = commands.add_parser("recount-activity", help="Recompute the group activity counters")
+    recount.add_argument("--group-id", type=int, default=None, help="Only recount this group")
+
+    commands.add_parser("backfill-rates", help="Resolve deferred exchange rates")
+
+    commands.add_parser("compact-places", help="Project raw answers and rekey rows of older versions in places_cache")
+
+    args = parser.parse_args(argv)
+
+    # make sure newer tables and columns exist on databases created before them
+    Base.metadata.create_all(bind=engine)
+    for name in migrate.add_missing_columns(engine):
+        print(f"Added {name}")
+
+    if args.command == "rebuild-ledger":
+        count = rebuild_ledger(args.group_id)
+        print(f"Rebuilt ledger for {count} group(s)")
+    elif args.command == "build-snapshots":
+        count = build_snapshots()
+        print(f"Built {count} snapshot(s)")
+    elif args.command == "backfill-converted":
+        count = backfill_converted(args.group_id)
+        print(f"Backfilled converted amounts for {count} group(s)")
+    elif args.command == "recount-activity":
+        count = recount_activity(args.group_id)
+        print(f"Recounted activity for {count} group(s)")
+    elif args.command == "backfill-rates":
+        count = backfill_rates()
+        print(f"Resolved {count} deferred exchange rate(s)")
+    elif args.command == "compact-places":
+        count = compact_places()
+        print(f"Rewrote or removed {count} places cache row(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,597 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from fastapi.testclient import TestClient
+import pytest
+from backend.schema import Base, User, GroupMember, Group, GroupBalance, Split, Transaction
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.deps import get_current_user  # your auth dep
+from app.main import app
+from app import backfill, fx, ledger
+import random
+
+def get_current_user_override(user):
+    def override():
+        return user
+    return override
+
+def create_user(db: Session, email="a@x.com", name="Alice") -> User:
+    u = User(email=email, display_name=name, google_sub=email)
+    db.add(u)
+    db.commit()
+    db.refresh(u)
+    return u
+
+def create_group_and_users(db: Session, num_users: int) -> tuple[Group, list[User], list[GroupMember]]:
+    assert num_users >= 1
+    users = [create_user(db, email=f"tester{i}@gmail.com", name=f"tester{i}") for i in range(num_users)]
+    g = Group(
+        name=f"Trip Random {random.randint(0, 1000)}",
+        description = "This is a test description",
+        created_by = users[0].id,
+        base_currency = "JPY"
+    )
+
+    db.add(g)
+    db.commit()
+    db.refresh(g)
+
+    members = [GroupMember(group_id=g.id, user_id=user.id, is_admin=(i == 0)) for i, user in enumerate(users)]
+    for m in members:
+        db.add(m)
+    db.commit()
+
+    return g, users, members
+
+def transaction_payload(payer: User, splits: list[tuple[User, str]], currency="JPY", rate=None):
+    return {
+        "payer_id": payer.id,
+        "total_amount_cents": str(sum(Decimal(amount) for _, amount in splits)),
+        "exchange_rate_to_group": rate,
+        "currency": currency,
+        "title": "Dinner",
+        "splits": [{"user_id": user.id, "amount_cents": amount} for user, amount in splits],
+    }
+
+def dues_by_user(client: TestClient, group_id: int) -> dict[int, Decimal]:
+    resp = client.get(f"/groups/{group_id}/dues")
+    assert resp.status_code == 200
+    return {due["other_user_id"]: Decimal(due["amount_owed"]) for due in resp.json()}
+
+@pytest.fixture
+def setup_env(client, db_session):
+    g, users, members = create_group_and_users(db_session, 4)
+    return g, users, members
+
+def test_ledger_tracks_create_update_delete(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], [(users[1], "30.00"), (users[2], "30.00")]))
+    assert resp.status_code == 200
+    tx_id = resp.json()["id"]
+
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[1], [(users[0], "100.00")], currency="USD", rate=2.0))
+    assert resp.status_code == 200
+
+    dues = dues_by_user(client, group.id)
+    assert dues[users[1].id] == Decimal("-170")
+    assert dues[users[2].id] == Decimal("30")
+    assert dues[users[3].id] == 0
+
+    resp = client.put(f"/transactions/{tx_id}", json={"total_amount_cents": "90.00", "splits": [
+        {"user_id": users[2].id, "amount_cents": "45.00"},
+        {"user_id": users[3].id, "amount_cents": "45.00"},
+    ]})
+    assert resp.status_code == 200
+
+    dues = dues_by_user(client, group.id)
+    assert dues[users[1].id] == Decimal("-200")
+    assert dues[users[2].id] == Decimal("45")
+    assert dues[users[3].id] == Decimal("45")
+
+    resp = client.delete(f"/transaction/{tx_id}")
+    assert resp.status_code == 204
+
+    dues = dues_by_user(client, group.id)
+    assert dues[users[2].id] == 0
+    assert dues[users[3].id] == 0
+
+    # seen from the other side the sign flips
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[1])
+    assert dues_by_user(client, group.id)[users[0].id] == Decimal("200")
+
+def test_rebuild_matches_incremental_ledger(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    for payer, splits in [
+        (users[0], [(users[1], "10.00"), (users[2], "20.00")]),
+        (users[2], [(users[0], "5.50"), (users[3], "7.25")]),
+        (users[3], [(users[1], "12.00")]),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits))
+        assert resp.status_code == 200
+
+    def stored():
+        rows = db_session.query(GroupBalance).filter_by(group_id=group.id).all()
+        return {(r.user_a, r.user_b): Decimal(r.amount) for r in rows if r.amount}
+
+    incremental = stored()
+    ledger.rebuild_group(db_session, group)
+    db_session.commit()
+
+    assert stored() == incremental
+
+def test_apply_deltas_from_two_sessions(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ledger.db'}")
+    Base.metadata.create_all(bind=engine)
+    Sessions = sessionmaker(bind=engine)
+    with Sessions() as db:
+        users = [create_user(db, email=f"u{i}@x.com") for i in range(3)]
+        group = Group(name="Trip", created_by=users[0].id)
+        db.add(group)
+        db.commit()
+        group_id, (a, b, c) = group.id, sorted(user.id for user in users)
+        ledger.apply_deltas(db, group_id, {(a, b): Decimal("10")})
+        db.commit()
+
+    first, second = Sessions(), Sessions()
+    try:
+        # the second writer already holds an old copy of the row
+        old = second.query(GroupBalance).one()
+        assert old.amount == Decimal("10")
+        ledger.apply_deltas(first, group_id, {(a, b): Decimal("5"), (a, c): Decimal("1")})
+        first.commit()
+        ledger.apply_deltas(second, group_id, {(a, b): Decimal("3"), (a, c): Decimal("2")})
+        second.commit()
+
+        rows = {(row.user_a, row.user_b): row.amount for row in first.query(GroupBalance).populate_existing()}
+        assert rows == {(a, b): Decimal("18"), (a, c): Decimal("3")}
+    finally:
+        first.close()
+        second.close()
+        engine.dispose()
+
+def test_converted_amounts_stored_and_backfilled(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], [(users[1], "10.00"), (users[2], "2.50")], currency="USD", rate=2.0))
+    assert resp.status_code == 200
+    tx_id = resp.json()["id"]
+
+    transaction = db_session.get(Transaction, tx_id)
+    assert transaction.total_in_group_currency == Decimal("25")
+    assert sorted(split.amount_in_group_currency for split in transaction.splits) == [Decimal("5"), Decimal("20")]
+
+    resp = client.put(f"/transactions/{tx_id}", json={"total_amount_cents": "18.75", "splits": [
+        {"user_id": users[1].id, "amount_cents": "15.00"},
+        {"user_id": users[2].id, "amount_cents": "3.75"},
+    ]})
+    assert resp.status_code == 200
+    db_session.expire_all()
+    assert db_session.get(Transaction, tx_id).total_in_group_currency == Decimal("37.5")
+    assert dues_by_user(client, group.id)[users[1].id] == Decimal("30")
+
+    # rows written before the columns existed
+    db_session.query(Split).filter_by(transaction_id=tx_id).update({"amount_in_group_currency": None})
+    db_session.query(Transaction).filter_by(id=tx_id).update({"total_in_group_currency": None})
+    ledger.convert_group(db_session, group)
+    ledger.rebuild_group(db_session, group)
+    db_session.commit()
+
+    db_session.expire_all()
+    assert db_session.get(Transaction, tx_id).total_in_group_currency == Decimal("37.5")
+    assert dues_by_user(client, group.id)[users[1].id] == Decimal("30")
+
+def test_unconverted_base_currency_rows_edited(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], [(users[1], "10.00"), (users[2], "2.50")]))
+    assert resp.status_code == 200
+    tx_id = resp.json()["id"]
+    # written before the converted amounts existed, and not backfilled yet
+    db_session.query(Split).filter_by(transaction_id=tx_id).update({"amount_in_group_currency": None})
+    db_session.query(Transaction).filter_by(id=tx_id).update({"total_in_group_currency": None})
+    db_session.commit()
+
+    def stored():
+        db_session.expire_all()
+        return {(row.user_a, row.user_b): row.amount for row in db_session.query(GroupBalance) if row.amount}
+
+    resp = client.put(f"/transactions/{tx_id}", json={"total_amount_cents": "6.00", "splits": [{"user_id": users[1].id, "amount_cents": "6.00"}]})
+    assert resp.status_code == 200
+    assert stored() == {(users[0].id, users[1].id): Decimal("6")}
+
+    resp = client.delete(f"/transaction/{tx_id}")
+    assert resp.status_code in (200, 204)
+    assert stored() == {}
+
+def test_balance_matrix_matches_dues(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    for payer, splits, currency, rate in [
+        (users[0], [(users[1], "10.00"), (users[2], "20.00")], "JPY", None),
+        (users[2], [(users[0], "5.50"), (users[3], "7.25")], "USD", 3.0),
+        (users[3], [(users[1], "12.00")], "JPY", None),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits, currency, rate))
+        assert resp.status_code == 200
+
+    resp = client.get(f"/groups/{group.id}/balances")
+    assert resp.status_code == 200
+    data = resp.json()
+    member_ids = data["member_ids"]
+    matrix = [[Decimal(amount) for amount in row] for row in data["balances"]]
+    assert member_ids == sorted(u.id for u in users)
+
+    for i in range(len(member_ids)):
+        for j in range(len(member_ids)):
+            assert matrix[i][j] == -matrix[j][i]
+
+    me = member_ids.index(users[0].id)
+    for other_id, amount in dues_by_user(client, group.id).items():
+        assert matrix[me][member_ids.index(other_id)] == amount.quantize(Decimal("0.01"))
+    assert matrix[me][member_ids.index(users[2].id)] == Decimal("3.50")
+
+def test_plan_settlement_clears_all_positions():
+    rng = random.Random(7)
+    net = {user_id: Decimal(rng.randint(-50000, 50000)) / 100 for user_id in range(1, 200)}
+    # make the group balance out
+    net[200] = -sum(net.values())
+
+    transfers = ledger.plan_settlement(net)
+    assert len(transfers) <= len(net) - 1
+
+    remaining = dict(net)
+    for from_user_id, to_user_id, amount in transfers:
+        assert amount > 0
+        remaining[from_user_id] += amount
+        remaining[to_user_id] -= amount
+    assert all(amount == 0 for amount in remaining.values())
+
+def test_settle_up_endpoint(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    # users 1, 2 and 3 each owe user 0 for dinner, user 1 also owes user 2
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], [(users[1], "30.00"), (users[2], "30.00"), (users[3], "30.00")]))
+    assert resp.status_code == 200
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[2], [(users[1], "10.00")]))
+    assert resp.status_code == 200
+
+    resp = client.get(f"/groups/{group.id}/settle-up")
+    assert resp.status_code == 200
+    transfers = {(t["from_user_id"], t["to_user_id"]): Decimal(t["amount"]) for t in resp.json()["transfers"]}
+    assert transfers == {
+        (users[1].id, users[0].id): Decimal("40.00"),
+        (users[3].id, users[0].id): Decimal("30.00"),
+        (users[2].id, users[0].id): Decimal("20.00"),
+    }
+
+def test_dues_convert_deferred_transactions_per_currency(client: TestClient, db_session: Session, setup_env, monkeypatch):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    # rate lookups fail when writing, so both transactions are stored without a rate
+    monkeypatch.setattr("app.routers.transactions.get_exchange_rate", lambda *args, **kwargs: None)
+    for payer, splits in [
+        (users[0], [(users[1], "10.00"), (users[2], "4.00")]),
+        (users[0], [(users[1], "5.00")]),
+        (users[1], [(users[0], "1.00")]),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits, currency="USD"))
+        assert resp.status_code == 200
+        assert resp.json()["exchange_rate_to_group"] is None
+
+    rows = ledger.pair_currency_sums(db_session, group, users[0].id, pending_only=True)
+    assert sorted((r.payer_id, r.user_id, r.currency, Decimal(r.unconverted)) for r in rows) == [
+        (users[0].id, users[1].id, "USD", Decimal("15")),
+        (users[0].id, users[2].id, "USD", Decimal("4")),
+        (users[1].id, users[0].id, "USD", Decimal("1")),
+    ]
+
+    monkeypatch.setattr("app.routers.groups.get_exchange_rate", lambda *args, **kwargs: 150.0)
+    dues = dues_by_user(client, group.id)
+    assert dues[users[1].id] == Decimal("2100")
+    assert dues[users[2].id] == Decimal("600")
+
+def test_backfill_resolves_deferred_rates(client: TestClient, db_session: Session, setup_env, monkeypatch):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    monkeypatch.setattr("app.routers.transactions.get_exchange_rate", lambda *args, **kwargs: None)
+    for payer, splits, currency in [
+        (users[0], [(users[1], "10.00")], "USD"),
+        (users[1], [(users[0], "2.00")], "EUR"),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits, currency))
+        assert resp.status_code == 200
+    assert ledger.groups_with_pending(db_session) == [group.id]
+
+    now = int(datetime.now(timezone.utc).timestamp())
+    fx.store_sheets(db_session, [{
+        "base_code": "JPY", "time_last_update_unix": now, "time_next_update_unix": now + 3600,
+        "rates": {"JPY": 1, "USD": 0.01},
+    }])
+    db_session.commit()
+
+    # only USD has a rate, the EUR transaction stays deferred
+    assert backfill.backfill_rates(db_session, fetch=False) == 1
+    transaction = db_session.query(Transaction).filter_by(currency="USD").one()
+    assert transaction.exchange_rate_to_group == 100.0
+    assert transaction.total_in_group_currency == Decimal("1000")
+    assert db_session.get(Group, group.id).total_spent_base == Decimal("1000")
+    assert ledger.read_balances(db_session, group.id, users[0].id) == {users[1].id: Decimal("1000")}
+    assert ledger.pending_rate_keys(db_session, group) == [("EUR", datetime.now(timezone.utc).date())]
+
+def test_my_balances_across_groups(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    # a second group with a different base currency and an empty third group
+    resp = client.post("/groups", json={"name": "Second", "base_currency": "USD"})
+    assert resp.status_code == 201
+    second_id = resp.json()["id"]
+    resp = client.post("/groups", json={"name": "Empty", "base_currency": "USD"})
+    assert resp.status_code == 201
+    empty_id = resp.json()["id"]
+    resp = client.post(f"/groups/{second_id}/members", json={"user_id": users[1].id})
+    assert resp.status_code == 200
+
+    for group_id, payer, splits, currency in [
+        (group.id, users[0], [(users[1], "30.00"), (users[2], "10.00")], "JPY"),
+        (group.id, users[1], [(users[0], "5.00")], "JPY"),
+        (second_id, users[1], [(users[0], "8.00")], "USD"),
+    ]:
+        resp = client.post(f"/groups/{group_id}/transactions", json=transaction_payload(payer, splits, currency))
+        assert resp.status_code == 200
+
+    resp = client.get("/me/balances")
+    assert resp.status_code == 200
+    data = resp.json()
+
+    nets = {g["group_id"]: Decimal(g["net"]) for g in data["groups"]}
+    assert nets == {group.id: Decimal("35"), second_id: Decimal("-8"), empty_id: 0}
+
+    counterparties = {(c["other_user_id"], c["currency"]): Decimal(c["net"]) for c in data["counterparties"]}
+    assert counterparties == {
+        (users[1].id, "JPY"): Decimal("25"),
+        (users[2].id, "JPY"): Decimal("10"),
+        (users[1].id, "USD"): Decimal("-8"),
+    }
+
+    # archived groups are left out
+    resp = client.post(f"/groups/{second_id}/archive")
+    assert resp.status_code == 204
+    data = client.get("/me/balances").json()
+    assert {g["group_id"] for g in data["groups"]} == {group.id, empty_id}
+    assert {(c["other_user_id"], c["currency"]) for c in data["counterparties"]} == {(users[1].id, "JPY"), (users[2].id, "JPY")}
+
+def test_dues_look_up_each_currency_once(client: TestClient, db_session: Session, setup_env, monkeypatch):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    monkeypatch.setattr("app.routers.transactions.get_exchange_rate", lambda *args, **kwargs: None)
+    for payer, splits, currency in [
+        (users[0], [(users[1], "10.00"), (users[2], "4.00")], "USD"),
+        (users[1], [(users[0], "3.00")], "USD"),
+        (users[2], [(users[0], "2.00"), (users[3], "2.00")], "EUR"),
+        (users[0], [(users[3], "1.00")], "EUR"),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits, currency))
+        assert resp.status_code == 200
+
+    lookups = []
+    def fake_rate(transaction_currency, group_currency, **kwargs):
+        lookups.append(transaction_currency)
+        return {"USD": 100.0, "EUR": 200.0}[transaction_currency]
+    monkeypatch.setattr("app.routers.groups.get_exchange_rate", fake_rate)
+
+    dues = dues_by_user(client, group.id)
+    assert sorted(lookups) == ["EUR", "USD"]
+    assert dues[users[1].id] == Decimal("700")
+    assert dues[users[2].id] == Decimal("0")
+    assert dues[users[3].id] == Decimal("200")
+
+def test_balance_history_buckets(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    # Monday, Tuesday and the following Monday
+    days = [datetime(2025, 3, 3, 12), datetime(2025, 3, 4, 9), datetime(2025, 3, 10, 18)]
+    for when, (payer, splits) in zip(days, [
+        (users[0], [(users[1], "30.00"), (users[2], "10.00")]),
+        (users[1], [(users[0], "5.00")]),
+        (users[2], [(users[0], "10.00"), (users[1], "3.00")]),
+    ]):
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits))
+        assert resp.status_code == 200
+        tx = db_session.get(Transaction, resp.json()["id"])
+        tx.created_at = when
+    db_session.commit()
+
+    resp = client.get(f"/groups/{group.id}/balances/history", params={"bucket": "day"})
+    assert resp.status_code == 200
+    points = [(p["bucket_start"][:10], {int(k): Decimal(v) for k, v in p["balances"].items()}) for p in resp.json()["points"]]
+    assert points == [
+        ("2025-03-03", {users[1].id: Decimal("30"), users[2].id: Decimal("10")}),
+        ("2025-03-04", {users[1].id: Decimal("25"), users[2].id: Decimal("10")}),
+        ("2025-03-10", {users[1].id: Decimal("25"), users[2].id: Decimal("0")}),
+    ]
+
+    resp = client.get(f"/groups/{group.id}/balances/history", params={"bucket": "week"})
+    assert resp.status_code == 200
+    assert [p["bucket_start"][:10] for p in resp.json()["points"]] == ["2025-03-03", "2025-03-10"]
+    assert Decimal(resp.json()["points"][0]["balances"][str(users[1].id)]) == Decimal("25")
+
+    resp = client.get(f"/groups/{group.id}/balances/history", params={"bucket": "month"})
+    assert resp.status_code == 422
+
+def test_close_period_keeps_balances(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    days = [datetime(2025, 3, 3, 12), datetime(2025, 3, 4, 9)]
+    tx_ids = []
+    for when, (payer, splits) in zip(days, [
+        (users[0], [(users[1], "30.00"), (users[2], "10.00")]),
+        (users[1], [(users[0], "5.00")]),
+    ]):
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(payer, splits))
+        assert resp.status_code == 200
+        tx_ids.append(resp.json()["id"])
+        db_session.get(Transaction, resp.json()["id"]).created_at = when
+    db_session.commit()
+
+    before = dues_by_user(client, group.id)
+    resp = client.post(f"/groups/{group.id}/close-period", json={"cutoff": "2025-03-05T00:00:00Z"})
+    assert resp.status_code == 201
+    assert resp.json()["closed_transactions"] == 2
+
+    # not after the last cutoff
+    resp = client.post(f"/groups/{group.id}/close-period", json={"cutoff": "2025-03-04T00:00:00Z"})
+    assert resp.status_code == 400
+
+    resp = client.put(f"/transactions/{tx_ids[0]}", json={"title": "Lunch"})
+    assert resp.status_code == 409
+    resp = client.delete(f"/transaction/{tx_ids[1]}")
+    assert resp.status_code == 409
+
+    resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[2], [(users[0], "4.00")]))
+    assert resp.status_code == 200
+    db_session.get(Transaction, resp.json()["id"]).created_at = datetime(2025, 3, 10, 18)
+    db_session.commit()
+
+    dues = dues_by_user(client, group.id)
+    assert dues[users[1].id] == before[users[1].id] == Decimal("25")
+    assert dues[users[2].id] == Decimal("6")
+
+    # only live transactions are replayed, the checkpoint supplies the rest
+    rows = ledger.pair_currency_sums(db_session, group)
+    assert [(row.payer_id, row.user_id) for row in rows] == [(users[2].id, users[0].id)]
+    ledger.rebuild_group(db_session, group)
+    db_session.commit()
+    assert dues_by_user(client, group.id) == dues
+
+    data = client.get(f"/groups/{group.id}/balances").json()
+    me = data["member_ids"].index(users[0].id)
+    assert Decimal(data["balances"][me][data["member_ids"].index(users[1].id)]) == Decimal("25")
+
+    resp = client.get(f"/groups/{group.id}/balances/history", params={"bucket": "day"})
+    points = [(p["bucket_start"][:10], {int(k): Decimal(v) for k, v in p["balances"].items()}) for p in resp.json()["points"]]
+    assert points == [
+        ("2025-03-05", {users[1].id: Decimal("25"), users[2].id: Decimal("10")}),
+        ("2025-03-10", {users[1].id: Decimal("25"), users[2].id: Decimal("6")}),
+    ]
+
+def test_close_period_cutoff_with_offset(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    for when in [datetime(2025, 3, 4, 22), datetime(2025, 3, 4, 23, 30)]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], [(users[1], "10.00")]))
+        assert resp.status_code == 200
+        db_session.get(Transaction, resp.json()["id"]).created_at = when
+    db_session.commit()
+
+    # 08:00 in Tokyo is 23:00 UTC the day before
+    resp = client.post(f"/groups/{group.id}/close-period", json={"cutoff": "2025-03-05T08:00:00+09:00"})
+    assert resp.status_code == 201
+    assert resp.json()["closed_transactions"] == 1
+    checkpoint = ledger.latest_checkpoint(db_session, group.id)
+    assert checkpoint.cutoff.replace(tzinfo=timezone.utc) == datetime(2025, 3, 4, 23, tzinfo=timezone.utc)
+
+    resp = client.post(f"/groups/{group.id}/close-period", json={"cutoff": "2025-03-05T00:45:00+01:00"})
+    assert resp.status_code == 201
+    assert resp.json()["closed_transactions"] == 1
+
+def test_base_change_rerates_transactions(client: TestClient, db_session: Session, setup_env, monkeypatch):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    for splits, currency, rate in [
+        ([(users[1], "10.00")], "USD", 150.0),
+        ([(users[2], "1000.00")], "JPY", None),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], splits, currency, rate))
+        assert resp.status_code == 200
+
+    resp = client.put(f"/groups/{group.id}", json={"base_currency": "EUR"})
+    assert resp.status_code == 200
+    # both wait on the old base's rate, nothing is left relative to JPY in the ledger
+    today = datetime.now(timezone.utc).date()
+    group = db_session.get(Group, group.id)
+    assert ledger.pending_rate_keys(db_session, group) == [("JPY", today)]
+    assert ledger.read_balances(db_session, group.id, users[0].id) == {}
+
+    # reads convert once per (old base, day), keeping the USD transaction's own rate
+    monkeypatch.setattr("app.routers.groups.get_exchange_rate", lambda *args, **kwargs: 0.006)
+    dues = {user_id: amount.quantize(Decimal("0.01")) for user_id, amount in dues_by_user(client, group.id).items()}
+    assert dues[users[1].id] == Decimal("9.00") and dues[users[2].id] == Decimal("6.00")
+
+    now = int(datetime.now(timezone.utc).timestamp())
+    fx.store_sheets(db_session, [{
+        "base_code": "JPY", "time_last_update_unix": now, "time_next_update_unix": now + 3600,
+        "rates": {"JPY": 1, "EUR": 0.006, "USD": 0.0067},
+    }])
+    db_session.commit()
+
+    assert backfill.backfill_rates(db_session, fetch=False) == 2
+    rates = {t.currency: t.exchange_rate_to_group for t in db_session.query(Transaction)}
+    assert rates["USD"] == pytest.approx(0.9) and rates["JPY"] == pytest.approx(0.006)
+    assert db_session.query(Transaction).filter(Transaction.rerate_from.is_not(None)).count() == 0
+    balances = ledger.read_balances(db_session, group.id, users[0].id)
+    assert balances[users[1].id] == Decimal("9") and balances[users[2].id] == Decimal("6")
+
+def test_base_change_keeps_closed_periods(client: TestClient, db_session: Session, setup_env, monkeypatch):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    tx_ids = []
+    for splits, currency, rate in [
+        ([(users[1], "10.00")], "USD", 150.0),
+        ([(users[2], "1000.00")], "JPY", None),
+    ]:
+        resp = client.post(f"/groups/{group.id}/transactions", json=transaction_payload(users[0], splits, currency, rate))
+        assert resp.status_code == 200
+        tx_ids.append(resp.json()["id"])
+    resp = client.post(f"/groups/{group.id}/close-period", json={})
+    assert resp.status_code == 201
+    assert resp.json()["closed_transactions"] == 2
+
+    resp = client.put(f"/groups/{group.id}", json={"base_currency": "EUR"})
+    assert resp.status_code == 200
+    # still closed while they wait on the re-rating
+    db_session.expire_all()
+    assert all(db_session.get(Transaction, tx_id).checkpoint_id is not None for tx_id in tx_ids)
+    assert client.put(f"/transactions/{tx_ids[0]}", json={"title": "Lunch"}).status_code == 409
+    assert client.delete(f"/transaction/{tx_ids[1]}").status_code == 409
+
+    monkeypatch.setattr("app.routers.groups.get_exchange_rate", lambda *args, **kwargs: 0.006)
+    dues = {user_id: amount.quantize(Decimal("0.01")) for user_id, amount in dues_by_user(client, group.id).items()}
+    assert dues[users[1].id] == Decimal("9.00") and dues[users[2].id] == Decimal("6.00")
+
+    now = int(datetime.now(timezone.utc).timestamp())
+    fx.store_sheets(db_session, [{
+        "base_code": "JPY", "time_last_update_unix": now, "time_next_update_unix": now + 3600,
+        "rates": {"JPY": 1, "EUR": 0.006, "USD": 0.0067},
+    }])
+    db_session.commit()
+    assert backfill.backfill_rates(db_session, fetch=False) == 2
+
+    # re-rated, they are back in the checkpoint's totals in the new currency
+    group = db_session.get(Group, group.id)
+    checkpoint = ledger.latest_checkpoint(db_session, group.id)
+    assert {(a, b): Decimal(amount) for a, b, amount in checkpoint.balances} == {
+        (users[0].id, users[1].id): Decimal("9"), (users[0].id, users[2].id): Decimal("6"),
+    }
+    assert ledger.pair_currency_sums(db_session, group) == []
+    balances = ledger.read_balances(db_session, group.id, users[0].id)
+    ledger.rebuild_group(db_session, group)
+    db_session.commit()
+    assert ledger.read_balances(db_session, group.id, users[0].id) == balances
+    assert balances[users[1].id] == Decimal("9") and balances[users[2].id] == Decimal("6")
@@ -0,0 +1,150 @@
+import json
+import os
+from app.fx import RateTable, get_exchange_rate
+from app import fx
+
+def write_table(cache_dir, base, rates, expires):
+    data = {"result": "success", "base_code": base, "time_next_update_unix": expires, "rates": rates}
+    (cache_dir / f"{base}.json").write_text(json.dumps(data))
+    return data
+
+def test_rates_loaded_once_from_disk(tmp_path, monkeypatch):
+    write_table(tmp_path, "JPY", {"JPY": 1, "USD": 0.0064, "EUR": 0.0055}, 4102444800)
+    table = RateTable(tmp_path)
+    monkeypatch.setattr(table, "_fetch", lambda currency: False)
+
+    assert table.get_rate("JPY", "USD") == 0.0064
+    # the inverse comes from the same row
+    assert table.get_rate("EUR", "JPY") == 1 / 0.0055
+
+    opened = []
+    monkeypatch.setattr(fx, "open", lambda *args, **kwargs: opened.append(args), raising=False)
+    assert table.get_rate("JPY", "EUR") == 0.0055
+    assert opened == []
+
+    # no table for either currency
+    assert table.get_rate("GBP", "CHF") is None
+
+def test_expired_rows_are_refreshed(tmp_path, monkeypatch):
+    write_table(tmp_path, "USD", {"USD": 1, "JPY": 150.0}, 1000)
+    table = RateTable(tmp_path)
+
+    fetched = []
+    def fetch(currency):
+        fetched.append(currency)
+        table.load({"base_code": "USD", "time_next_update_unix": 4102444800, "rates": {"USD": 1, "JPY": 155.0}})
+        return True
+    monkeypatch.setattr(table, "_fetch", fetch)
+
+    # the file on disk is stale, so the provider is asked
+    assert table.get_rate("USD", "JPY") == 155.0
+    assert fetched == ["USD"]
+    assert table.lookup("USD", "JPY", now=4102444800) is None
+
+def test_expired_files_are_read_once(tmp_path, monkeypatch):
+    write_table(tmp_path, "JPY", {"JPY": 1, "USD": 0.0064}, fx._now() - 60)
+    table = RateTable(tmp_path)
+
+    opened = []
+    real_open = open
+    monkeypatch.setattr(fx, "open", lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs), raising=False)
+    monkeypatch.setattr(fx, "request_refresh", lambda: None)
+
+    # the expired sheet is loaded once and then served stale from memory
+    for _ in range(3):
+        assert table.get_rate("JPY", "USD", fetch=False) == 0.0064
+    assert len(opened) == 1
+
+    # a rewritten file is picked up again
+    write_table(tmp_path, "JPY", {"JPY": 1, "USD": 0.0065}, 4102444800)
+    os.utime(tmp_path / "JPY.json", (2000000000, 2000000000))
+    assert table.get_rate("JPY", "USD", fetch=False) == 0.0065
+    assert len(opened) == 2
+
+def test_same_currency_needs_no_rate():
+    assert get_exchange_rate("USD", "USD") is None
+
+def test_pairs_triangulated_from_one_sheet(tmp_path, monkeypatch):
+    write_table(tmp_path, "USD", {"USD": 1, "JPY": 150.0, "EUR": 0.9, "GBP": 0.8}, 4102444800)
+    table = RateTable(tmp_path)
+
+    fetched = []
+    monkeypatch.setattr(table, "_fetch", lambda currency: fetched.append(currency) or False)
+
+    assert table.get_rate("EUR", "JPY") == 150.0 / 0.9
+    assert table.get_rate("JPY", "GBP") == 0.8 / 150.0
+    assert fetched == []
+
+    # a currency nobody quotes is asked for once, then not again until the retry window passes
+    assert table.get_rate("KPW", "JPY") is None
+    assert table.get_rate("KPW", "JPY") is None
+    assert fetched == ["KPW"]
+    # and codes outside ISO 4217 are never sent to the provider
+    assert table.get_rate("XTS", "JPY") is None
+    assert fetched == ["KPW"]
+
+def test_dated_rates_are_stored_and_reused(tmp_path, db_session, monkeypatch):
+    from datetime import date
+    from backend.schema import FxRate
+
+    table = RateTable(tmp_path)
+    monkeypatch.setattr(fx, "rate_table", table)
+    march = {"result": "success", "base_code": "USD", "time_last_update_unix": 1740960000,  # 2025-03-03
+             "time_next_update_unix": 4102444800, "rates": {"USD": 1, "JPY": 150.0, "EUR": 0.9}}
+    table.load(march)
+    fx.store_sheets(db_session, [march])
+    fx.store_sheets(db_session, [march])
+    assert db_session.query(FxRate).count() == 3
+
+    may = dict(march, time_last_update_unix=1746403200, rates={"USD": 1, "JPY": 140.0, "EUR": 0.8})  # 2025-05-05
+    fx.store_sheets(db_session, [may])
+
+    # the latest recent sheet on or before the day, else the first one after it
+    assert get_exchange_rate("EUR", "JPY", db=db_session, on=date(2025, 3, 5)) == 150.0 / 0.9
+    assert get_exchange_rate("EUR", "JPY", db=db_session, on=date(2025, 4, 1)) == 140.0 / 0.8
+    assert get_exchange_rate("EUR", "JPY", db=db_session, on=date(2025, 5, 8)) == 140.0 / 0.8
+    assert get_exchange_rate("USD", "JPY", db=db_session, on=date(2024, 1, 1)) == 150.0
+
+    # nothing stored for this pair, the live table is asked and its sheet kept
+    table.load(dict(march, base_code="GBP", rates={"GBP": 1, "USD": 1.25}))
+    assert get_exchange_rate("GBP", "USD", db=db_session, on=date(2025, 3, 3)) == 1.25
+    assert db_session.query(FxRate).filter_by(base="GBP").count() == 2
+
+    # read-only handlers get the live rate without writing the sheet
+    table.load(dict(march, base_code="CHF", rates={"CHF": 1, "SEK": 12.0}))
+    assert get_exchange_rate("CHF", "SEK", db=db_session, on=date(2025, 3, 3), fetch=False, store=False) == 12.0
+    assert db_session.query(FxRate).filter_by(base="CHF").count() == 0
+
+def test_stale_sheet_served_while_refreshing(tmp_path, monkeypatch):
+    table = RateTable(tmp_path)
+    fetched = []
+    monkeypatch.setattr(table, "_fetch", lambda currency: fetched.append(currency) or False)
+    kicks = []
+    monkeypatch.setattr(fx, "request_refresh", lambda: kicks.append(True))
+
+    now = fx._now()
+    table.load({"base_code": "USD", "time_next_update_unix": now - 60, "rates": {"USD": 1, "JPY": 150.0}})
+
+    # requests get the expired rate without touching the provider
+    assert table.get_rate("USD", "JPY", fetch=False) == 150.0
+    assert fetched == [] and kicks == [True]
+    # past the grace period it is no longer served
+    assert table.lookup("USD", "JPY", now + fx.STALE_GRACE_SECONDS, stale_grace=fx.STALE_GRACE_SECONDS) is None
+
+def test_refresh_due_fetches_sheets_before_expiry(tmp_path, monkeypatch):
+    table = RateTable(tmp_path)
+    now = fx._now()
+    table.load({"base_code": "USD", "time_next_update_unix": now + 3 * 3600, "rates": {"USD": 1, "JPY": 150.0}})
+    table.load({"base_code": "EUR", "time_next_update_unix": now + 60, "rates": {"EUR": 1, "JPY": 160.0}})
+
+    fetched = []
+    def fetch(currency):
+        fetched.append(currency)
+        table.load({"base_code": currency, "time_next_update_unix": now + 6 * 3600, "rates": {currency: 1, "JPY": 161.0}})
+        return True
+    monkeypatch.setattr(table, "_fetch", fetch)
+
+    wait = table.refresh_due(lead=300)
+    assert fetched == ["EUR"]
+    # next up is USD, 3 hours away minus the lead, capped at the max wait
+    assert wait == fx.REFRESH_MAX_WAIT_SECONDS
@@ -1,4 +1,5 @@
-from backend.schema import User, GroupMember, Group
+from decimal import Decimal
+from backend.schema import User, GroupMember, Group, GroupBalance, Transaction
 from sqlalchemy.orm import Session
 from app.deps import get_current_user  # your auth dep
 from app.main import app
@@ -242,6 +243,36 @@ def test_removing_other_user(client, db_session):
     check_all = client.get("/groups/1/all-members")
     assert len(check_resp.json()) == 1
     assert len(check_all.json()) == 2
+
+def test_member_count_follows_membership(client, db_session):
+    user1 = create_user(db_session, "test@test.com",  "tester1")
+    user2 = create_user(db_session, "test2@text.com", "tester2")
+    app.dependency_overrides[get_current_user] = get_current_user_override(user1)
+
+    resp = client.post("/groups", json={"name": "Flat", "base_currency": "JPY"})
+    assert resp.status_code == 201
+    group_id = resp.json()["id"]
+    assert resp.json()["member_count"] == 1
+
+    resp = client.post(f"/groups/{group_id}/members", json={"user_id": user2.id})
+    assert resp.status_code == 200
+    assert client.get(f"/groups/{group_id}").json()["member_count"] == 2
+
+    resp = client.delete(f"/groups/{group_id}/members/{user2.id}")
+    assert resp.status_code == 204
+    assert client.get(f"/groups/{group_id}").json()["member_count"] == 1
+
+def test_group_currency_validated(client, db_session):
+    user1 = create_user(db_session, "test@test.com",  "tester1")
+    app.dependency_overrides[get_current_user] = get_current_user_override(user1)
+
+    resp = client.post("/groups", json={"name": "Flat", "base_currency": "EUR"})
+    assert resp.status_code == 201
+    assert resp.json()["base_currency"] == "EUR"
+
+    for code in ("eur", "ZZZ", "XAU", "EURO"):
+        resp = client.post("/groups", json={"name": "Flat", "base_currency": code})
+        assert resp.status_code == 422
   
 def test_edit_group_info(client, db_session):
     user1 = create_user(db_session, "test@test.com",  "tester1")
@@ -356,3 +387,64 @@ def test_group_member_query_runs_without_error():
         assert True
     finally:
         db.close()
+
+def test_archived_group_served_from_snapshot(client, db_session):
+    admin = create_user(db_session, email="admin@x.com", name="Admin")
+    other = create_user(db_session, email="other@x.com", name="Other")
+    group, _ = create_group(db_session, admin)
+    add_member(db_session, group, other)
+    app.dependency_overrides[get_current_user] = get_current_user_override(admin)
+
+    payload = {
+        "payer_id": admin.id,
+        "total_amount_cents": "40.00",
+        "currency": "JPY",
+        "title": "Hotel",
+        "splits": [{"user_id": other.id, "amount_cents": "40.00"}],
+    }
+    resp = client.post(f"/groups/{group.id}/transactions", json=payload)
+    assert resp.status_code == 200
+
+    resp = client.post(f"/groups/{group.id}/archive")
+    assert resp.status_code == 204
+    db_session.refresh(group)
+    assert group.snapshot is not None
+
+    # wipe the live rows, reads of the archived group must not notice
+    db_session.query(Transaction).delete()
+    db_session.query(GroupBalance).delete()
+    db_session.commit()
+
+    resp = client.get(f"/groups/{group.id}/dues")
+    assert resp.status_code == 200
+    assert [(d["other_user_id"], Decimal(d["amount_owed"])) for d in resp.json()] == [(other.id, Decimal("40"))]
+
+    resp = client.get(f"/groups/{group.id}/transactions")
+    assert resp.status_code == 200
+    assert [t["title"] for t in resp.json()] == ["Hotel"]
+    assert resp.json()[0]["splits"][0]["user_display_name"] == "Other"
+
+    resp = client.get(f"/groups/{group.id}/all-members")
+    assert resp.status_code == 200
+    assert {m["user_id"] for m in resp.json()} == {admin.id, other.id}
+
+    # a rename reaches the frozen roster and transaction rows
+    app.dependency_overrides[get_current_user] = get_current_user_override(other)
+    resp = client.put("/me", json={"email": None, "display_name": "Renamed"})
+    assert resp.status_code == 200
+    app.dependency_overrides[get_current_user] = get_current_user_override(admin)
+    resp = client.get(f"/groups/{group.id}/transactions")
+    assert resp.json()[0]["splits"][0]["user_display_name"] == "Renamed"
+    assert resp.json()[0]["payer_display_name"] == "Admin"
+    resp = client.get(f"/groups/{group.id}/all-members")
+    assert {m["user_id"]: m["display_name"] for m in resp.json()}[other.id] == "Renamed"
+
+    # unarchiving drops the snapshot and reads go live again
+    resp = client.post(f"/groups/{group.id}/unarchive")
+    assert resp.status_code == 204
+    db_session.refresh(group)
+    assert group.snapshot is None
+
+    resp = client.get(f"/groups/{group.id}/transactions")
+    assert resp.status_code == 200
+    assert resp.json() == []
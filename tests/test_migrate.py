@@ -0,0 +1,81 @@
+from decimal import Decimal
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from app import activity, ledger, migrate
+from backend.schema import Base, Group, GroupBalance, Split, Transaction
+
+# tables as the first release created them, before any of the added columns
+BASELINE_DDL = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL PRIMARY KEY, email VARCHAR(320), display_name VARCHAR(200),
+        created_at DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, google_sub VARCHAR NOT NULL UNIQUE,
+        is_active BOOLEAN DEFAULT '1' NOT NULL, deleted_at DATETIME)""",
+    """CREATE TABLE groups (
+        id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(200) NOT NULL, description TEXT,
+        created_by INTEGER REFERENCES users (id) ON DELETE SET NULL,
+        created_at DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, base_currency VARCHAR(3) DEFAULT 'USD' NOT NULL,
+        location_name VARCHAR(300), location_lat VARCHAR(50), location_lon VARCHAR(50),
+        is_archived BOOLEAN DEFAULT '0' NOT NULL, deleted_at DATETIME)""",
+    """CREATE TABLE group_members (
+        id INTEGER NOT NULL PRIMARY KEY, group_id INTEGER NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        joined_at DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, is_admin BOOLEAN DEFAULT '0' NOT NULL, left_at DATETIME)""",
+    """CREATE TABLE transactions (
+        id INTEGER NOT NULL PRIMARY KEY, group_id INTEGER NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+        payer_id INTEGER REFERENCES users (id) ON DELETE SET NULL, creator_id INTEGER REFERENCES users (id) ON DELETE SET NULL,
+        created_at DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, title VARCHAR(300), memo TEXT,
+        total_amount_cents NUMERIC(18, 6) NOT NULL, currency VARCHAR(3) DEFAULT 'USD', exchange_rate_to_group FLOAT)""",
+    """CREATE TABLE splits (
+        id INTEGER NOT NULL PRIMARY KEY, transaction_id INTEGER NOT NULL REFERENCES transactions (id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, amount_cents NUMERIC(18, 6) NOT NULL,
+        is_payer BOOLEAN DEFAULT '0' NOT NULL, note VARCHAR(400))""",
+    """CREATE TABLE places_cache (
+        city VARCHAR NOT NULL PRIMARY KEY, response JSON, lon VARCHAR, lat VARCHAR, updated_at DATETIME)""",
+]
+
+def test_baseline_database_is_migrated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for ddl in BASELINE_DDL:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users (id, display_name, google_sub) VALUES (1, 'a', 'a'), (2, 'b', 'b')"))
+        conn.execute(text("INSERT INTO groups (id, name, created_by, base_currency) VALUES (1, 'Trip', 1, 'EUR')"))
+        conn.execute(text("INSERT INTO group_members (group_id, user_id) VALUES (1, 1), (1, 2)"))
+        conn.execute(text(
+            "INSERT INTO transactions (id, group_id, payer_id, creator_id, total_amount_cents, currency, exchange_rate_to_group) "
+            "VALUES (1, 1, 1, 1, 20, 'USD', 0.5)"
+        ))
+        conn.execute(text("INSERT INTO splits (transaction_id, user_id, amount_cents, is_payer) VALUES (1, 1, 10, 1), (1, 2, 10, 0)"))
+
+    Base.metadata.create_all(bind=engine)
+    added = migrate.add_missing_columns(engine)
+    for name in ("transactions.total_in_group_currency", "transactions.checkpoint_id", "transactions.rerate_from",
+                 "splits.amount_in_group_currency", "groups.member_count", "groups.transaction_count",
+                 "groups.total_spent_base", "groups.last_activity_at", "places_cache.grid_x", "places_cache.grid_y",
+                 "ix_transaction_group_checkpoint", "ix_places_cache_grid"):
+        assert name in added
+    # a second run finds nothing to do
+    assert migrate.add_missing_columns(engine) == []
+    assert {"grid_x", "grid_y"} <= {column["name"] for column in inspect(engine).get_columns("places_cache")}
+
+    # the backfills from manage.py work on the migrated tables
+    db = sessionmaker(bind=engine)()
+    try:
+        group = db.get(Group, 1)
+        assert group.member_count == 0 and group.total_spent_base == 0
+        ledger.convert_group(db, group)
+        ledger.rebuild_group(db, group)
+        assert activity.recount(db) == 1
+        db.commit()
+
+        db.expire_all()
+        assert db.get(Transaction, 1).total_in_group_currency == Decimal("10")
+        assert db.get(Transaction, 1).checkpoint_id is None
+        assert sorted(split.amount_in_group_currency for split in db.query(Split)) == [Decimal("5"), Decimal("5")]
+        group = db.get(Group, 1)
+        assert (group.member_count, group.transaction_count, group.total_spent_base) == (2, 1, Decimal("10"))
+        balance = db.query(GroupBalance).one()
+        assert (balance.user_a, balance.user_b, balance.amount) == (1, 2, Decimal("5"))
+    finally:
+        db.close()
+        engine.dispose()
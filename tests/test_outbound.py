@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from app import outbound
+
+class StubAdapter(BaseAdapter):
+    """Answers every request with the next status code, or raises ConnectionError for None."""
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status is None:
+            raise requests.ConnectionError("refused")
+        resp = requests.Response()
+        resp.status_code = status
+        resp.request = request
+        resp.url = request.url
+        resp._content = b"{}"
+        return resp
+
+    def close(self):
+        pass
+
+@pytest.fixture(autouse=True)
+def fresh_breakers():
+    outbound.reset_breakers()
+    yield
+    outbound.reset_breakers()
+
+def test_breaker_opens_after_repeated_failures(monkeypatch):
+    client = outbound.OutboundClient()
+    adapter = StubAdapter([None] * outbound.BREAKER_THRESHOLD)
+    client.mount("https://flaky.test", adapter)
+
+    for _ in range(outbound.BREAKER_THRESHOLD):
+        with pytest.raises(requests.ConnectionError):
+            client.get("https://flaky.test/rates")
+    assert adapter.calls == outbound.BREAKER_THRESHOLD
+
+    # open: refused without calling the host
+    with pytest.raises(outbound.UpstreamUnavailable):
+        client.get("https://flaky.test/rates")
+    assert adapter.calls == outbound.BREAKER_THRESHOLD
+
+    # after the cooldown one trial call goes through and closes it again
+    _, breaker = outbound.breaker_for("https://flaky.test")
+    monkeypatch.setattr(breaker, "opened_at", breaker.opened_at - outbound.BREAKER_COOLDOWN_SECONDS)
+    assert client.get("https://flaky.test/rates").status_code == 200
+    assert client.get("https://flaky.test/rates").status_code == 200
+    assert breaker.failures == 0
+
+def test_client_errors_do_not_trip_breaker():
+    client = outbound.OutboundClient()
+    client.mount("https://places.test", StubAdapter([404] * (outbound.BREAKER_THRESHOLD + 1)))
+    for _ in range(outbound.BREAKER_THRESHOLD + 1):
+        assert client.get("https://places.test/v2").status_code == 404
+
+def test_async_client_retries_server_errors(monkeypatch):
+    monkeypatch.setattr(outbound, "RETRY_BACKOFF", 0)
+    statuses = [503, 200]
+    def handler(request):
+        return httpx.Response(statuses.pop(0), json={})
+
+    async def run():
+        client = outbound.AsyncOutboundClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.get("https://fx.test/latest")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()).status_code == 200
+    assert statuses == []
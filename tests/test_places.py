@@ -0,0 +1,232 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import places
+from backend.schema import Base, PlacesCache, PlacesLease
+
+GEOCODE = {"lon": 139.69, "lat": 35.69, "place_id": "abc"}
+PLACES = [{"name": "Senso-ji", "categories": ["tourism.sights"], "lon": 139.79, "lat": 35.71}]
+
+@pytest.fixture(autouse=True)
+def empty_memory():
+    places.clear_memory()
+    yield
+    places.clear_memory()
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+    monkeypatch.setattr(places, "geocode", lambda city: calls.append(city) or GEOCODE)
+    monkeypatch.setattr(places, "fetch_places", lambda lon, lat: calls.append((lon, lat)) or PLACES)
+    return calls
+
+def test_city_names_share_one_entry(client, db_session, upstream):
+    for city in ("Tokyo", "tokyo", " Tokyo ", "TOKYO"):
+        resp = client.get(f"/places/{city}")
+        assert resp.status_code == 200
+        assert resp.json()["places"] == PLACES
+
+    assert len(upstream) == 2  # one geocode, one places call
+    assert [row.city for row in db_session.query(PlacesCache)] == ["tokyo"]
+
+def test_popular_city_served_from_memory(client, db_session, upstream):
+    assert client.get("/places/Tokyo").json()["source"] == "geoapify"
+
+    # the row is gone but the in-process tier still answers
+    db_session.query(PlacesCache).delete()
+    db_session.commit()
+    resp = client.get("/places/tokyo")
+    assert resp.json() == {"source": "cache", "places": PLACES}
+    assert len(upstream) == 2
+
+    # without it the table is consulted (and here refetched)
+    places.clear_memory()
+    assert client.get("/places/tokyo").json()["source"] == "geoapify"
+
+def test_expired_entry_served_while_refreshed(client, db_session, upstream):
+    old = {"type": "FeatureCollection", "features": []}
+    db_session.add(PlacesCache(
+        city="tokyo", response=old, lon="139.69", lat="35.69",
+        updated_at=datetime.now(timezone.utc) - places.CACHE_TTL - timedelta(hours=1),
+    ))
+    db_session.commit()
+
+    # without the refresher running the stale answer is still served, nothing is fetched
+    assert client.get("/places/Tokyo").json() == {"source": "stale", "places": []}
+    assert upstream == []
+
+    places.start_refresher(sessionmaker(bind=db_session.get_bind()))
+    try:
+        assert client.get("/places/Tokyo").json() == {"source": "stale", "places": []}
+    finally:
+        places.stop_refresher(wait=True)
+
+    # one refresh fetched around the stored point and persisted the row
+    assert upstream == [("139.69", "35.69")]
+    db_session.expire_all()
+    assert db_session.get(PlacesCache, "tokyo").response == PLACES
+    assert client.get("/places/tokyo").json() == {"source": "cache", "places": PLACES}
+
+def test_refresh_skipped_when_row_is_fresh(db_session, upstream):
+    # another process refreshed the row after this one read the stale copy
+    places.store(db_session, "tokyo", PLACES, "139.69", "35.69")
+    db_session.commit()
+
+    refresher = places.Refresher(sessionmaker(bind=db_session.get_bind()))
+    assert refresher.schedule("tokyo", "139.69", "35.69")
+    refresher.shutdown()
+    assert upstream == []
+
+def test_concurrent_lookups_fetch_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'places.db'}", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    calls = []
+    def fetch(db):
+        calls.append(1)
+        time.sleep(0.2)
+        return places.save(db, "tokyo", PLACES, "139.69", "35.69"), True
+
+    results = []
+    def lookup():
+        db = Session()
+        try:
+            results.append(places.single_flight(db, "tokyo", lambda: fetch(db)))
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=lookup) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(fetched for _, fetched in results) == [False] * 4 + [True]
+    assert all(entry.response == PLACES for entry, _ in results)
+    engine.dispose()
+
+def test_lease_of_another_process_is_waited_for(db_session, monkeypatch):
+    db_session.add(PlacesLease(city="tokyo", holder="other:1", expires_at=datetime.now(timezone.utc) + timedelta(seconds=30)))
+    db_session.commit()
+
+    # the other process writes its row while we poll
+    def other_process_finishes(seconds):
+        db_session.add(PlacesCache(city="tokyo", response=PLACES, lon="139.69", lat="35.69"))
+        db_session.commit()
+    monkeypatch.setattr(places.time, "sleep", other_process_finishes)
+
+    entry, fetched = places.single_flight(db_session, "tokyo", lambda: pytest.fail("fetched twice"))
+    assert entry.response == PLACES and not fetched
+
+def test_expired_lease_is_taken_over(db_session):
+    db_session.add(PlacesLease(city="tokyo", holder="other:1", expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+    db_session.commit()
+
+    entry, fetched = places.single_flight(db_session, "tokyo", lambda: (places.save(db_session, "tokyo", PLACES, "139.69", "35.69"), True))
+    assert fetched and entry.response == PLACES
+    # released once written
+    assert db_session.query(PlacesLease).count() == 0
+
+def test_nearby_names_reuse_places(client, db_session, monkeypatch):
+    points = {"Shinjuku": (139.70, 35.69), "Asakusa": (139.80, 35.71), "Osaka": (135.50, 34.69)}
+    calls = []
+    def geocode(city):
+        calls.append(city)
+        lon, lat = points[city]
+        return {"lon": lon, "lat": lat, "place_id": city}
+    monkeypatch.setattr(places, "geocode", geocode)
+    monkeypatch.setattr(places, "fetch_places", lambda lon, lat: calls.append((lon, lat)) or [{"name": "center", "categories": [], "lon": lon, "lat": lat}])
+
+    assert client.get("/places/Shinjuku").json()["source"] == "geoapify"
+    # ~9 km away: too far to reuse
+    assert client.get("/places/Asakusa").json()["source"] == "geoapify"
+    assert client.get("/places/Osaka").json()["source"] == "geoapify"
+    assert len(calls) == 6
+
+    # within 5 km of Shinjuku: one geocode, no places call
+    points["Shibuya"] = (139.70, 35.66)
+    resp = client.get("/places/Shibuya").json()
+    assert resp == {"source": "nearby", "places": [{"name": "center", "categories": [], "lon": 139.70, "lat": 35.69}]}
+    assert calls[6:] == ["Shibuya"]
+
+    # the geocoded point is kept per name, so a cold process needs no upstream call at all
+    places.clear_memory()
+    assert client.get("/places/shibuya").json()["source"] == "nearby"
+    assert len(calls) == 7
+
+def test_expired_nearby_entry_refreshed(client, db_session, monkeypatch):
+    calls = []
+    monkeypatch.setattr(places, "geocode", lambda city: calls.append(city) or {"lon": 139.70, "lat": 35.66, "place_id": city})
+    monkeypatch.setattr(places, "fetch_places", lambda lon, lat: calls.append((lon, lat)) or PLACES)
+    db_session.add(PlacesCache(
+        city="shinjuku", response=[], lon="139.7", lat="35.69", grid_x=2793, grid_y=713,
+        updated_at=datetime.now(timezone.utc) - places.CACHE_TTL - timedelta(hours=1),
+    ))
+    db_session.commit()
+
+    # an expired entry found near the geocoded point is served stale and refreshed
+    places.start_refresher(sessionmaker(bind=db_session.get_bind()))
+    try:
+        assert client.get("/places/Shibuya").json() == {"source": "stale", "places": []}
+    finally:
+        places.stop_refresher(wait=True)
+    assert calls == ["Shibuya", ("139.7", "35.69")]
+
+    # the name that reused it picks up the refreshed entry instead of its stale copy
+    assert client.get("/places/Shibuya").json() == {"source": "nearby", "places": PLACES}
+
+def test_nearest_respects_radius(db_session):
+    # one degree of longitude is ~111 km at the equator, ~56 km at 60 degrees north
+    assert places.distance_meters(0, 0, 1, 0) == pytest.approx(111195, rel=1e-3)
+    assert places.distance_meters(10, 60, 11, 60) == pytest.approx(55597, rel=1e-2)
+
+    # cells are narrow up north, the lookup has to reach a few columns over
+    places.store(db_session, "oslo-ish", PLACES, "10.0", "60.0")
+    db_session.commit()
+    assert places.nearest(db_session, 10.08, 60.0).key == "oslo-ish"  # ~4.4 km
+    assert places.nearest(db_session, 10.1, 60.0) is None             # ~5.6 km
+
+def test_raw_rows_are_projected(client, db_session):
+    raw = {"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": {}, "properties": {
+        "name": "浅草寺", "name_international": {"en": "Senso-ji", "ja": "浅草寺"},
+        "formatted": "2-3-1 Asakusa, Taito, Tokyo", "categories": ["tourism", "tourism.sights"],
+        "website": "https://www.senso-ji.jp", "lon": 139.79, "lat": 35.71,
+        "datasource": {"sourcename": "openstreetmap", "raw": {"osm_id": 1}}, "place_id": "51abc",
+    }}]}
+    db_session.add(PlacesCache(city="tokyo", response=raw, lon="139.69", lat="35.69"))
+    db_session.commit()
+
+    assert client.get("/places/Tokyo").json()["places"] == [{
+        "name": "浅草寺", "name_en": "Senso-ji", "address": "2-3-1 Asakusa, Taito, Tokyo",
+        "categories": ["tourism", "tourism.sights"], "website": "https://www.senso-ji.jp",
+        "lon": 139.79, "lat": 35.71,
+    }]
+
+def test_old_rows_are_compacted(db_session):
+    now = datetime.now(timezone.utc)
+    raw = {"type": "FeatureCollection", "features": [{"properties": {"name": "Senso-ji", "lon": 139.79, "lat": 35.71}}]}
+    db_session.add_all([
+        # stored under the raw path string, before keys were normalized
+        PlacesCache(city="Tokyo", response=raw, lon="139.69", lat="35.69", updated_at=now - timedelta(days=2)),
+        PlacesCache(city="TOKYO ", response=raw, lon="139.69", lat="35.69", updated_at=now - timedelta(days=1)),
+        PlacesCache(city="Osaka", response=[], lon="135.5", lat="34.69", updated_at=now),
+        PlacesCache(city="osaka", response=PLACES, lon="135.5", lat="34.69", updated_at=now - timedelta(days=3)),
+    ])
+    db_session.commit()
+
+    assert places.compact(db_session) == 4
+    db_session.commit()
+    rows = {row.city: row for row in db_session.query(PlacesCache)}
+    assert sorted(rows) == ["osaka", "tokyo"]
+    assert rows["tokyo"].updated_at.replace(tzinfo=timezone.utc) == now - timedelta(days=1)
+    assert rows["tokyo"].response == [{"name": "Senso-ji", "categories": [], "lon": 139.79, "lat": 35.71}]
+    assert (rows["tokyo"].grid_x, rows["tokyo"].grid_y) == places.grid_cell(139.69, 35.69)
+    assert rows["osaka"].response == PLACES
+    assert places.compact(db_session) == 0
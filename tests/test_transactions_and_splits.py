@@ -5,7 +5,10 @@ from backend.schema import User, GroupMember, Group, Transaction, Split
 from sqlalchemy.orm import Session
 from app.deps import get_current_user  # your auth dep
 from app.main import app
+from app import ledger
 import random
+import csv
+import io
 
 def get_current_user_override(user):
     def override():
@@ -424,4 +427,70 @@ def test_transaction_exchange(client: TestClient, db_session: Session, setup_env
     resp = client.get("/groups/1/dues")
     assert resp.status_code == 200
     # should double
-    assert Decimal(resp.json()["dues"]["2"]) == Decimal("60.00")
\ No newline at end of file
+    assert Decimal(resp.json()["dues"]["2"]) == Decimal("60.00")
+
+def test_export_transactions_streams_csv(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    for i in range(5):
+        payload = {
+            "payer_id": users[0].id,
+            "total_amount_cents": "20.00",
+            "currency": "JPY",
+            "title": f"Meal {i}",
+            "splits": [
+                {"user_id": users[1].id, "amount_cents": "12.00"},
+                {"user_id": users[2].id, "amount_cents": "8.00"},
+            ],
+        }
+        resp = client.post(f"/groups/{group.id}/transactions", json=payload)
+        assert resp.status_code == 200
+
+    chunks = list(ledger.iter_transaction_chunks(db_session, group.id, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert all(len(splits) == 2 for chunk in chunks for _, splits in chunk)
+
+    resp = client.get(f"/groups/{group.id}/transactions/export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert len(rows) == 10
+    assert [row["title"] for row in rows[::2]] == [f"Meal {i}" for i in range(5)]
+    assert {row["split_user_id"] for row in rows} == {str(users[1].id), str(users[2].id)}
+
+def test_group_activity_counters(client: TestClient, db_session: Session, setup_env):
+    group, users, _ = setup_env
+    app.dependency_overrides[get_current_user] = get_current_user_override(users[0])
+
+    ids = []
+    for total, currency, rate in [("20.00", "JPY", None), ("10.00", "USD", 2.0)]:
+        payload = {
+            "payer_id": users[0].id,
+            "total_amount_cents": total,
+            "currency": currency,
+            "exchange_rate_to_group": rate,
+            "title": "Meal",
+            "splits": [{"user_id": users[1].id, "amount_cents": total}],
+        }
+        resp = client.post(f"/groups/{group.id}/transactions", json=payload)
+        assert resp.status_code == 200
+        ids.append(resp.json()["id"])
+
+    resp = client.put(f"/transactions/{ids[0]}", json={"total_amount_cents": "30.00", "splits": [{"user_id": users[1].id, "amount_cents": "30.00"}]})
+    assert resp.status_code == 200
+
+    data = client.get(f"/groups/{group.id}").json()
+    assert data["transaction_count"] == 2
+    assert Decimal(data["total_spent_base"]) == Decimal("50")
+    assert data["last_activity_at"] is not None
+
+    resp = client.get(f"/groups/{group.id}/transactions", params={"limit": 1})
+    assert resp.headers["X-Total-Count"] == "2"
+    assert len(resp.json()) == 1
+
+    resp = client.delete(f"/transaction/{ids[1]}")
+    assert resp.status_code == 204
+    data = client.get(f"/groups/{group.id}").json()
+    assert data["transaction_count"] == 1
+    assert Decimal(data["total_spent_base"]) == Decimal("30")